@@ -0,0 +1,263 @@
+"""
+Append-only ledger of AI completions: tokens, model, latency and outcome per
+user. Entries are buffered in memory and written in batches, so reports lag
+by up to AI_LEDGER_FLUSH_INTERVAL. For a cross-tenant view while chasing a
+slow provider:
+
+    python ai_ledger.py --days 2
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from database import async_session, async_read_session
+from models import AICompletion
+
+AI_LEDGER_FLUSH_SIZE = int(os.getenv("AI_LEDGER_FLUSH_SIZE", "200"))
+AI_LEDGER_FLUSH_INTERVAL = float(os.getenv("AI_LEDGER_FLUSH_INTERVAL", "5"))
+# Entries kept for retry while the database is unavailable; older ones are dropped
+AI_LEDGER_MAX_PENDING = int(os.getenv("AI_LEDGER_MAX_PENDING", "10000"))
+
+# Successful completions per calendar month (UTC) by subscription tier
+AI_QUOTAS = {
+    "free": int(os.getenv("AI_QUOTA_FREE", "50")),
+    "pro": int(os.getenv("AI_QUOTA_PRO", "1000")),
+    "enterprise": int(os.getenv("AI_QUOTA_ENTERPRISE", "10000")),
+}
+
+# USD per million (prompt, completion) tokens, for the cost estimate in reports
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+class AIQuotaExceeded(Exception):
+    def __init__(self, tier: str, limit: int):
+        super().__init__(f"You've reached your {tier} plan limit of {limit} AI messages this month.")
+        self.tier = tier
+        self.limit = limit
+
+
+class Ledger:
+    """Write-behind buffer for AICompletion rows. Counters are per process."""
+
+    def __init__(self, flush_size: int = AI_LEDGER_FLUSH_SIZE, max_pending: int = AI_LEDGER_MAX_PENDING):
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.pending: List[dict] = []
+        self._writing: List[dict] = []
+        self._lock = asyncio.Lock()
+        self._tasks: set = set()
+        self.counters = {"recorded": 0, "written": 0, "dropped": 0, "failed_flushes": 0}
+
+    def record(self, user_id: int, kind: str, model: str, outcome: str, latency_ms: int,
+               prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.pending.append({
+            "user_id": user_id,
+            "kind": kind,
+            "model": model,
+            "outcome": outcome,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_ms": latency_ms,
+            "created_at": datetime.utcnow(),
+        })
+        self.counters["recorded"] += 1
+        if len(self.pending) >= self.flush_size and not self._lock.locked():
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def unwritten(self, user_id: int, since: datetime) -> int:
+        """Successful completions for the user that haven't reached the database yet."""
+        return sum(
+            1 for entry in (*self._writing, *self.pending)
+            if entry["user_id"] == user_id and entry["outcome"] == "ok" and entry["created_at"] >= since
+        )
+
+    async def flush(self) -> int:
+        async with self._lock:
+            # Swap the buffer out before awaiting so concurrent records aren't lost
+            self._writing, self.pending = self.pending, []
+            rows = self._writing
+            if not rows:
+                return 0
+            try:
+                async with async_session() as session:
+                    await session.execute(insert(AICompletion), rows)
+                    await session.commit()
+            except Exception:
+                logging.exception(f"AI ledger flush of {len(rows)} entries failed")
+                self.counters["failed_flushes"] += 1
+                self.pending = rows + self.pending
+                overflow = len(self.pending) - self.max_pending
+                if overflow > 0:
+                    del self.pending[:overflow]
+                    self.counters["dropped"] += overflow
+                return 0
+            finally:
+                self._writing = []
+            self.counters["written"] += len(rows)
+            return len(rows)
+
+    async def run(self, interval: float = AI_LEDGER_FLUSH_INTERVAL):
+        """Flush every `interval` seconds until cancelled, then once more."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": len(self.pending)}
+
+
+ledger = Ledger()
+
+
+def month_start(now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def quota_for(tier: Optional[str]) -> int:
+    return AI_QUOTAS.get(tier or "free", AI_QUOTAS["free"])
+
+
+async def monthly_completions(user_id: int) -> int:
+    """
+    Successful completions this month, including ones still buffered in this
+    process. Concurrent requests can overshoot the quota by a few; it is a
+    spending guard, not a hard limit.
+    """
+    since = month_start()
+    async with async_session() as session:
+        result = await session.execute(
+            select(func.count(AICompletion.id)).where(
+                AICompletion.user_id == user_id,
+                AICompletion.created_at >= since,
+                AICompletion.outcome == "ok",
+            )
+        )
+        stored = result.scalar_one()
+    return stored + ledger.unwritten(user_id, since)
+
+
+async def check_quota(user_id: int, tier: Optional[str]):
+    """Raise AIQuotaExceeded when the user has no completions left this month."""
+    limit = quota_for(tier)
+    if await monthly_completions(user_id) >= limit:
+        raise AIQuotaExceeded(tier or "free", limit)
+
+
+def model_prices(model: str) -> Optional[tuple]:
+    """
+    Prices for a model name as OpenAI reports it, which is usually a dated
+    snapshot such as gpt-4o-mini-2024-07-18. The longest matching prefix
+    wins, so gpt-4o-mini isn't priced as gpt-4o.
+    """
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    prices = model_prices(model or "")
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+def percentiles(values: List[int]) -> Dict[str, Optional[int]]:
+    """Nearest-rank percentiles plus the maximum."""
+    ordered = sorted(values)
+    if not ordered:
+        return {**{f"p{p}": None for p in PERCENTILES}, "max": None}
+    return {
+        **{f"p{p}": ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] for p in PERCENTILES},
+        "max": ordered[-1],
+    }
+
+
+def _summarize(rows: list) -> dict:
+    ok = [row for row in rows if row.outcome == "ok"]
+    prompt_tokens = sum(row.prompt_tokens for row in rows)
+    completion_tokens = sum(row.completion_tokens for row in rows)
+    costs = [estimate_cost(row.model, row.prompt_tokens, row.completion_tokens) for row in rows]
+    return {
+        "completions": len(ok),
+        "errors": sum(1 for row in rows if row.outcome == "error"),
+        "cancelled": sum(1 for row in rows if row.outcome == "cancelled"),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": round(sum(c for c in costs if c is not None), 6),
+        # Latency of successful completions only; errors are often fast timeouts or instant rejections
+        "latency_ms": percentiles([row.latency_ms for row in ok]),
+    }
+
+
+async def usage_report(session: AsyncSession, from_date: date, to_date: date, user_id: Optional[int] = None) -> dict:
+    """
+    Per-day totals, cost estimates and latency percentiles for one user, or
+    for every user when user_id is None. The range is a (user_id, created_at)
+    index scan, and its rows are aggregated here so percentiles work on both
+    PostgreSQL and SQLite.
+    """
+    query = select(
+        AICompletion.user_id, AICompletion.created_at, AICompletion.model, AICompletion.outcome,
+        AICompletion.prompt_tokens, AICompletion.completion_tokens, AICompletion.latency_ms,
+    ).where(
+        AICompletion.created_at >= datetime.combine(from_date, datetime.min.time()),
+        AICompletion.created_at < datetime.combine(to_date + timedelta(days=1), datetime.min.time()),
+    )
+    if user_id is not None:
+        query = query.where(AICompletion.user_id == user_id)
+    result = await session.execute(query)
+    rows = result.all()
+
+    by_day = defaultdict(list)
+    by_user = defaultdict(list)
+    for row in rows:
+        by_day[row.created_at.date()].append(row)
+        by_user[row.user_id].append(row)
+    report = {
+        "from": from_date.isoformat(),
+        "to": to_date.isoformat(),
+        "totals": _summarize(rows),
+        "days": [{"date": day.isoformat(), **_summarize(day_rows)} for day, day_rows in sorted(by_day.items())],
+    }
+    if user_id is None:
+        report["users"] = [{"user_id": uid, **_summarize(user_rows)} for uid, user_rows in sorted(by_user.items())]
+    return report
+
+
+async def _main(days: int, user_id: Optional[int]):
+    to_date = datetime.utcnow().date()
+    async with async_read_session() as session:
+        report = await usage_report(session, to_date - timedelta(days=days - 1), to_date, user_id)
+    print(f"{'date':<12}{'ok':>8}{'errors':>8}{'tokens':>12}{'cost $':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for day in report["days"] + [{"date": "total", **report["totals"]}]:
+        latency = day["latency_ms"]
+        print(
+            f"{day['date']:<12}{day['completions']:>8}{day['errors']:>8}"
+            f"{day['prompt_tokens'] + day['completion_tokens']:>12}{day['cost_usd']:>10.4f}"
+            f"{latency['p50'] or '-':>9}{latency['p95'] or '-':>9}{latency['p99'] or '-':>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI completion ledger report")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(_main(args.days, args.user_id))
@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from openai import AsyncOpenAI, OpenAIError
+from sqlalchemy import update
+from sqlmodel import select
+from database import async_session
+from models import Lead, MessageGenerationBatch, Notification, User
+from jobs import job_handler
+from cache import TieredCache, MISSING
+from ai_ledger import AIQuotaExceeded, check_quota, ledger
+from events import pubsub, user_topic
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "sk-xxx")
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4o-mini")
+AI_TEMPERATURE = 0.7
+# Concurrent completions per campaign batch
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "5"))
+# Drafts are written back once per this many processed leads
+AI_FLUSH_SIZE = int(os.getenv("AI_FLUSH_SIZE", "50"))
+MESSAGE_CACHE_TTL = float(os.getenv("MESSAGE_CACHE_TTL", str(7 * 24 * 3600)))
+MESSAGE_CACHE_MAX_ENTRIES = int(os.getenv("MESSAGE_CACHE_MAX_ENTRIES", "2000"))
+# Users whose hit/miss counters are kept; the least recently active are dropped
+MESSAGE_CACHE_MAX_USERS = int(os.getenv("MESSAGE_CACHE_MAX_USERS", "10000"))
+
+# Retries rate limits and 5xx itself, honouring Retry-After
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=60.0)
+
+message_cache = TieredCache("ai_messages", max_entries=MESSAGE_CACHE_MAX_ENTRIES)
+# user_id -> hits/misses/bypassed for this process
+user_cache_counters: "OrderedDict[int, Counter]" = OrderedDict()
+
+LEAD_INFO_TEMPLATE = """
+First Name: {first_name}
+Last Name: {last_name}
+Job Title: {job_title}
+Company: {company}
+Profile URL: {profile_url}
+"""
+
+PERSONAS = {
+    "email": "You are an expert email marketer with a proven track record in crafting high-converting cold email campaigns for B2B clients.",
+    "linkedin": "You are a seasoned LinkedIn outreach specialist, skilled in building professional relationships and starting meaningful conversations through LinkedIn messaging.",
+}
+
+
+def ai_configured() -> bool:
+    return bool(OPENAI_API_KEY) and OPENAI_API_KEY != "sk-xxx"
+
+
+def message_options(req: dict) -> dict:
+    """
+    Generation options from a request body, with the /generate-message
+    defaults. Raises ValueError for a non-numeric length.
+    """
+    msg_type = req.get("type", "linkedin")
+    return {
+        "tone": req.get("tone", "professional"),
+        "goal": req.get("goal", "connect"),  # e.g., connect, pitch, invite
+        "length": int(req.get("length", 300)),  # preferred max length in characters
+        "cta": req.get("cta", ""),  # optional call-to-action
+        "personalization": req.get("personalization", ""),  # shared interests, tags
+        "type": msg_type if msg_type in PERSONAS else "linkedin",
+    }
+
+
+def build_prompt(lead_info: str, options: dict) -> str:
+    channel = "email" if options["type"] == "email" else "LinkedIn"
+    return (
+        f"{PERSONAS[options['type']]} "
+        f"Write a {options['tone']} {channel} outreach message for the following campaign: {lead_info}. "
+        f"Goal: {options['goal']}. "
+        f"Personalization: {options['personalization']}. "
+        f"Include this call-to-action if provided: {options['cta']}. "
+        f"Keep it professional, personalized, and under {options['length']} characters."
+    )
+
+
+def _request(lead_info: str, options: dict) -> dict:
+    return {
+        "model": AI_MODEL,
+        "messages": [{"role": "user", "content": build_prompt(lead_info, options)}],
+        "max_tokens": round(options["length"] * 0.7),
+        "temperature": AI_TEMPERATURE,
+    }
+
+
+def _elapsed_ms(started: float) -> int:
+    return round((time.monotonic() - started) * 1000)
+
+
+async def generate_message(user_id: int, lead_info: str, options: dict, kind: str = "message") -> str:
+    """One completion, recorded in the AI ledger whether or not it succeeds."""
+    started = time.monotonic()
+    try:
+        response = await client.chat.completions.create(**_request(lead_info, options))
+    except Exception:
+        ledger.record(user_id, kind, AI_MODEL, "error", _elapsed_ms(started))
+        raise
+    usage = response.usage
+    ledger.record(
+        user_id, kind, response.model or AI_MODEL, "ok", _elapsed_ms(started),
+        prompt_tokens=usage.prompt_tokens if usage else 0,
+        completion_tokens=usage.completion_tokens if usage else 0,
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def stream_message(user_id: int, lead_info: str, options: dict) -> AsyncIterator[str]:
+    """
+    Yield the message text as it is generated. Latency in the ledger is the
+    time to the last token; a client disconnect is recorded as cancelled.
+    """
+    started = time.monotonic()
+    outcome, model, usage = "error", AI_MODEL, None
+    try:
+        stream = await client.chat.completions.create(
+            **_request(lead_info, options), stream=True, stream_options={"include_usage": True}
+        )
+        outcome = "cancelled"
+        async for chunk in stream:
+            model = chunk.model or model
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        outcome = "ok"
+    except OpenAIError:
+        outcome = "error"
+        raise
+    finally:
+        ledger.record(
+            user_id, "stream", model, outcome, _elapsed_ms(started),
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+        )
+
+
+def _normalize(value) -> str:
+    return " ".join(str(value or "").split())
+
+
+def count_cache_event(user_id: int, event: str):
+    counters = user_cache_counters.get(user_id)
+    if counters is None:
+        counters = user_cache_counters[user_id] = Counter()
+        while len(user_cache_counters) > MESSAGE_CACHE_MAX_USERS:
+            user_cache_counters.popitem(last=False)
+    user_cache_counters.move_to_end(user_id)
+    counters[event] += 1
+
+
+def cache_key(user_id: int, lead_info: str, options: dict) -> list:
+    """
+    Everything that shapes the completion, normalised so requests differing
+    only in whitespace or case of the option words share an entry. Entries
+    are per user: drafts can carry one tenant's personalization and aren't
+    served to another.
+    """
+    return [
+        user_id,
+        AI_MODEL,
+        AI_TEMPERATURE,
+        _normalize(lead_info),
+        _normalize(options["tone"]).lower(),
+        _normalize(options["goal"]).lower(),
+        options["length"],
+        _normalize(options["cta"]),
+        _normalize(options["personalization"]),
+        options["type"],
+    ]
+
+
+async def cached_message(user_id: int, lead_info: str, options: dict) -> Optional[str]:
+    """The cached draft for these inputs, or None. Counts the lookup against the user."""
+    message = await message_cache.get(cache_key(user_id, lead_info, options))
+    if message is MISSING:
+        count_cache_event(user_id, "misses")
+        return None
+    count_cache_event(user_id, "hits")
+    return message
+
+
+async def store_message(user_id: int, lead_info: str, options: dict, message: str):
+    await message_cache.set(cache_key(user_id, lead_info, options), message, MESSAGE_CACHE_TTL)
+
+
+async def generate_cached(user_id: int, tier: Optional[str], lead_info: str, options: dict,
+                          bypass: bool = False, kind: str = "message") -> Tuple[str, bool]:
+    """
+    generate_message behind message_cache. Returns (message, cached). With
+    `bypass` a fresh draft is always generated and replaces the cached one.
+    Cache hits don't count against the tier's AI quota; a miss over quota
+    raises AIQuotaExceeded.
+    """
+    if bypass:
+        count_cache_event(user_id, "bypassed")
+    else:
+        message = await cached_message(user_id, lead_info, options)
+        if message is not None:
+            return message, True
+    await check_quota(user_id, tier)
+    message = await generate_message(user_id, lead_info, options, kind=kind)
+    await store_message(user_id, lead_info, options, message)
+    return message, False
+
+
+def cache_stats(user_id: int) -> dict:
+    counters = user_cache_counters.get(user_id, {})
+    hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+    return {
+        **message_cache.stats(),
+        "user": {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": counters.get("bypassed", 0),
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        },
+    }
+
+
+def lead_info(lead) -> str:
+    return LEAD_INFO_TEMPLATE.format(
+        first_name=lead.first_name,
+        last_name=lead.last_name,
+        job_title=lead.job_title,
+        company=lead.company,
+        profile_url=lead.profile_url,
+    ).strip()
+
+
+async def run_generation_batch(batch_id: int, lead_ids: List[int], options: dict, overwrite: bool = False):
+    """
+    Draft a message for each lead under bounded concurrency and write them to
+    Lead.message_text in bulk, updating the MessageGenerationBatch as it goes.
+    Unless `overwrite` is set, leads that already have a draft are skipped,
+    which also makes a retry resume where the last attempt stopped; an
+    overwrite batch is redone in full and bypasses message_cache. Once the
+    user's AI quota runs out, the remaining leads are counted as failed.
+    """
+    pending: List[dict] = []
+    flush_lock = asyncio.Lock()
+    quota_error: List[str] = []
+
+    async with async_session() as session:
+        batch = await session.get(MessageGenerationBatch, batch_id)
+        user_id = batch.user_id
+        tier = (await session.get(User, user_id)).subscription_tier
+        query = (
+            select(Lead.id, Lead.first_name, Lead.last_name, Lead.job_title, Lead.company, Lead.profile_url)
+            .where(Lead.id.in_(lead_ids))
+            .order_by(Lead.id)
+        )
+        if not overwrite:
+            query = query.where((Lead.message_text == None) | (Lead.message_text == ""))
+        result = await session.execute(query)
+        leads = result.all()
+        queue: asyncio.Queue = asyncio.Queue()
+        for lead in leads:
+            queue.put_nowait(lead)
+        already_done = batch.total - len(leads)
+        counts = {"processed": already_done, "generated": already_done, "failed": 0}
+        batch.status = "running"
+        batch.processed, batch.generated = already_done, already_done
+        session.add(batch)
+        await session.commit()
+
+        async def flush(status: Optional[str] = None):
+            async with flush_lock:
+                # Swap the buffer out before awaiting so concurrent appends aren't lost
+                rows = list(pending)
+                pending.clear()
+                values = dict(counts)
+                if rows:
+                    await session.execute(update(Lead), rows)
+                if status:
+                    values.update(status=status, finished_at=datetime.utcnow())
+                await session.execute(update(MessageGenerationBatch).where(MessageGenerationBatch.id == batch_id).values(**values))
+                await session.commit()
+
+        async def worker():
+            while True:
+                try:
+                    lead = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if quota_error:
+                    counts["failed"] += 1
+                else:
+                    try:
+                        message, _ = await generate_cached(user_id, tier, lead_info(lead), options, bypass=overwrite, kind="batch")
+                        pending.append({"id": lead.id, "message_text": message})
+                        counts["generated"] += 1
+                    except AIQuotaExceeded as e:
+                        quota_error.append(str(e))
+                        counts["failed"] += 1
+                    except OpenAIError as e:
+                        logging.error(f"Message generation batch {batch_id} failed for lead {lead.id}: {e}")
+                        counts["failed"] += 1
+                counts["processed"] += 1
+                if counts["processed"] % AI_FLUSH_SIZE == 0:
+                    await flush()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(AI_CONCURRENCY, len(leads)) or 1)))
+        except Exception:
+            # Keep the drafts made so far; the job queue decides whether to retry
+            await flush()
+            raise
+        await flush(status="completed")
+
+        message = f"AI drafts finished: {counts['generated']} generated, {counts['failed']} failed."
+        if quota_error:
+            message += f" {quota_error[0]}"
+        notification = Notification(
+            user_id=user_id,
+            type="messages_generated" if not counts["failed"] else "message_generation_failed",
+            message=message,
+            created_at=datetime.utcnow()
+        )
+        session.add(notification)
+        await session.commit()
+        pubsub.publish(user_topic(user_id, "notifications"))
+
+
+async def _generation_batch_dead(payload: dict, error: str):
+    async with async_session() as session:
+        await session.execute(
+            update(MessageGenerationBatch)
+            .where(MessageGenerationBatch.id == payload["batch_id"])
+            .values(status="failed", finished_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+@job_handler("generate_messages", on_dead=_generation_batch_dead)
+async def handle_generate_messages(payload: dict):
+    await run_generation_batch(payload["batch_id"], payload["lead_ids"], payload["options"], payload.get("overwrite", False))
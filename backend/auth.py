@@ -7,21 +7,48 @@ from datetime import datetime, timedelta
 from models import User
 from database import get_session
 from schemas import UserRegister, UserLogin, Token
-from auth_utils import get_current_user
+from auth_utils import get_current_user, invalidate_principal, principal_cache_stats
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
 import os
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Changing the cost upgrades existing hashes on the user's next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so hashing threads run in parallel with the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes running or waiting for a thread; past this, /login and /register shed load with a 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
 router = APIRouter(tags=["auth"])
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def _run_hasher(fn, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-ins in progress, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+async def verify_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """Returns (valid, new_hash); new_hash is set when the stored hash should be upgraded."""
+    return await _run_hasher(pwd_context.verify_and_update, plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await _run_hasher(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -35,7 +62,7 @@ async def register(user: UserRegister, session: AsyncSession = Depends(get_sessi
     db_user = result.scalar_one_or_none()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_pw = get_password_hash(user.password)
+    hashed_pw = await get_password_hash(user.password)
     subscription_tier = user.subscription_tier if hasattr(user, 'subscription_tier') and user.subscription_tier else "free"
     new_user = User(email=user.email, password_hash=hashed_pw, subscription_tier=subscription_tier)
     session.add(new_user)
@@ -48,8 +75,16 @@ async def register(user: UserRegister, session: AsyncSession = Depends(get_sessi
 async def login(user: UserLogin, session: AsyncSession = Depends(get_session)):
     result = await session.execute(select(User).where(User.email == user.email))
     db_user = result.scalar_one_or_none()
-    if not db_user or not verify_password(user.password, db_user.password_hash):
+    if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_password(user.password, db_user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        db_user.password_hash = new_hash
+        session.add(db_user)
+        await session.commit()
+        invalidate_principal(db_user.email)
     access_token = create_access_token({"sub": db_user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -61,6 +96,11 @@ async def get_current_user_endpoint(user: User = Depends(get_current_user)):
         "subscription_tier": user.subscription_tier
     }
 
+@router.get("/auth/principal-cache/stats")
+async def get_principal_cache_stats(user: User = Depends(get_current_user)):
+    """Per-process counters for the get_current_user principal cache."""
+    return principal_cache_stats()
+
 @router.post("/logout")
 async def logout():
     return {"message": "Logged out successfully"}
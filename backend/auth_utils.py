@@ -4,8 +4,11 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from database import get_session
 from models import User
+from cache import LRUCache, MISSING
+from datetime import datetime, timedelta
 import os
 
 
@@ -13,6 +16,58 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 security = HTTPBearer()
 
+# Verified principals are kept per process for this long. Writes to a user
+# row call invalidate_principal, so the TTL only bounds how long another
+# process can serve a stale copy.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+# token subject -> column values of the User row
+_principals = LRUCache(PRINCIPAL_CACHE_MAX_ENTRIES)
+_principal_counters = {"hits": 0, "misses": 0, "invalidations": 0}
+# Bumped on every invalidation so a lookup that raced with one doesn't cache the old row
+_principal_generation = 0
+
+
+def invalidate_principal(subject: str):
+    """Drop a cached principal. Call after committing a change to the user row."""
+    global _principal_generation
+    _principal_generation += 1
+    _principal_counters["invalidations"] += 1
+    _principals.delete(subject)
+
+
+def principal_cache_stats() -> dict:
+    lookups = _principal_counters["hits"] + _principal_counters["misses"]
+    return {
+        **_principal_counters,
+        "evictions": _principals.evictions,
+        "expirations": _principals.expirations,
+        "size": len(_principals),
+        "capacity": _principals.max_entries,
+        "hit_rate": round(_principal_counters["hits"] / lookups, 4) if lookups else None,
+    }
+
+
+async def _load_principal(session: AsyncSession, email: str) -> User | None:
+    data = _principals.get(email)
+    if data is not MISSING:
+        _principal_counters["hits"] += 1
+        # Attach a copy to this request's session without a round trip, so
+        # handlers can still modify and commit it
+        user = User(**data)
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
+
+    _principal_counters["misses"] += 1
+    generation = _principal_generation
+    result = await session.execute(select(User).where(User.email == email))
+    user = result.scalar_one_or_none()
+    if user is not None and generation == _principal_generation:
+        data = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        _principals.set(email, data, datetime.utcnow() + timedelta(seconds=PRINCIPAL_CACHE_TTL))
+    return user
+
 def create_access_token(data: dict, expires_delta: int = 3600) -> str:
     """
     Create a JWT access token for the given data.
@@ -47,8 +102,7 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    result = await session.execute(select(User).where(User.email == email))
-    user = result.scalar_one_or_none()
+    user = await _load_principal(session, email)
     if user is None:
         raise credentials_exception
     
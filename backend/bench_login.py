@@ -0,0 +1,105 @@
+"""
+Login throughput benchmark.
+
+    python bench_login.py --logins 200 --concurrency 20
+    python bench_login.py --inline    # hash on the event loop, for comparison
+
+Runs the app in-process against DATABASE_URL, fires concurrent /api/login
+requests and meanwhile polls GET /api/user. Reports login throughput and the
+latency of the unrelated endpoint, which is what suffers if hashing blocks the
+event loop.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+import auth
+from database import engine
+from main import app
+from models import SQLModel
+
+PROBE_INTERVAL = 0.01
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summary(samples):
+    return (
+        f"p50 {percentile(samples, 50) * 1000:.1f}ms  p99 {percentile(samples, 99) * 1000:.1f}ms  "
+        f"max {max(samples) * 1000:.1f}ms  n={len(samples)}"
+    )
+
+
+async def main(logins: int, concurrency: int, inline: bool):
+    if inline:
+        async def run_inline(fn, *args):
+            return fn(*args)
+        auth._run_hasher = run_inline
+
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "bench-password"}
+        resp = await client.post("/api/register", json=credentials)
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        await client.get("/api/user", headers=headers)
+
+        login_latencies, probe_latencies, statuses = [], [], {}
+        done = asyncio.Event()
+        queue: asyncio.Queue = asyncio.Queue()
+        for _ in range(logins):
+            queue.put_nowait(None)
+
+        async def login_worker():
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                resp = await client.post("/api/login", json=credentials)
+                login_latencies.append(time.perf_counter() - started)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+        async def probe():
+            # Timed from when the probe asked to wake up, so event-loop stalls
+            # count against it even if they happen between requests
+            while not done.is_set():
+                started = time.perf_counter() + PROBE_INTERVAL
+                await asyncio.sleep(PROBE_INTERVAL)
+                await client.get("/api/user", headers=headers)
+                probe_latencies.append(time.perf_counter() - started)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+    await engine.dispose()
+
+    print(f"mode: {'inline' if inline else 'executor'}  bcrypt rounds: {auth.BCRYPT_ROUNDS}  "
+          f"hash workers: {auth.PASSWORD_HASH_WORKERS}  max pending: {auth.PASSWORD_HASH_MAX_PENDING}")
+    print(f"logins: {logins} in {elapsed:.2f}s ({logins / elapsed:.1f}/s)  statuses: {statuses}")
+    print(f"login latency:    {summary(login_latencies)}")
+    print(f"GET /api/user:    {summary(probe_latencies)}  mean {statistics.mean(probe_latencies) * 1000:.1f}ms")
+    print(f"probe rate:       {len(probe_latencies) / elapsed:.1f}/s (ideal {1 / PROBE_INTERVAL:.0f}/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure login throughput and event-loop stalls")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--inline", action="store_true", help="hash on the event loop (pre-executor behaviour)")
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.concurrency, args.inline))
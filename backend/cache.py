@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete
+from sqlmodel import select
+from database import async_session, dialect_insert
+from models import CacheEntry
+
+# Sentinel for "not cached", since None is a legitimate cached value
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded in-process LRU whose entries each carry their own expiry."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return MISSING
+        expires_at, value = item
+        if expires_at <= datetime.utcnow():
+            del self._data[key]
+            self.expirations += 1
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, expires_at: datetime):
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+
+class TieredCache:
+    """
+    In-process LRU in front of the shared cacheentry table. Values must be
+    JSON-serialisable; keys are any JSON-serialisable structure and are
+    stored hashed, scoped by `namespace`. Counters are per process.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1024):
+        self.namespace = namespace
+        self.local = LRUCache(max_entries)
+        self.counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "writes": 0}
+
+    @staticmethod
+    def make_key(parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def get(self, parts: Any) -> Any:
+        key = self.make_key(parts)
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.counters["local_hits"] += 1
+            return value
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(CacheEntry.value, CacheEntry.expires_at).where(
+                        CacheEntry.namespace == self.namespace,
+                        CacheEntry.key == key,
+                        CacheEntry.expires_at > datetime.utcnow(),
+                    )
+                )
+                row = result.first()
+        except Exception:
+            # A cache outage should cost latency, not fail the caller
+            logging.exception(f"Shared cache read failed for namespace {self.namespace}")
+            row = None
+        if row is None:
+            self.counters["misses"] += 1
+            return MISSING
+        value = json.loads(row.value)
+        self.local.set(key, value, row.expires_at)
+        self.counters["shared_hits"] += 1
+        return value
+
+    async def set(self, parts: Any, value: Any, ttl: float):
+        key = self.make_key(parts)
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        self.local.set(key, value, expires_at)
+        self.counters["writes"] += 1
+        stmt = dialect_insert(CacheEntry).values(
+            namespace=self.namespace,
+            key=key,
+            value=json.dumps(value, default=str),
+            expires_at=expires_at,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["namespace", "key"],
+            set_={"value": stmt.excluded.value, "expires_at": stmt.excluded.expires_at},
+        )
+        try:
+            async with async_session() as session:
+                await session.execute(stmt)
+                await session.commit()
+        except Exception:
+            logging.exception(f"Shared cache write failed for namespace {self.namespace}")
+
+    async def delete(self, parts: Any):
+        key = self.make_key(parts)
+        self.local.delete(key)
+        async with async_session() as session:
+            await session.execute(delete(CacheEntry).where(CacheEntry.namespace == self.namespace, CacheEntry.key == key))
+            await session.commit()
+
+    async def purge_expired(self) -> int:
+        """Delete this namespace's expired rows from the shared table."""
+        async with async_session() as session:
+            result = await session.execute(
+                delete(CacheEntry).where(CacheEntry.namespace == self.namespace, CacheEntry.expires_at <= datetime.utcnow())
+            )
+            await session.commit()
+            return result.rowcount
+
+    def stats(self) -> dict:
+        lookups = self.counters["local_hits"] + self.counters["shared_hits"] + self.counters["misses"]
+        hits = self.counters["local_hits"] + self.counters["shared_hits"]
+        return {
+            **self.counters,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "local_size": len(self.local),
+            "local_capacity": self.local.max_entries,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+        }
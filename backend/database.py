@@ -1,15 +1,60 @@
-
 from dotenv import load_dotenv
 load_dotenv()
 from sqlmodel import SQLModel, create_engine
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
 from typing import AsyncGenerator
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Replica for list/export/analytics reads; the primary when unset. Reads
+# through it can lag the primary by the replication delay.
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or DATABASE_URL
+
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds before a pooled connection is replaced; keep below any server or proxy idle timeout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+
+def _engine_options(url: str) -> dict:
+    options = {"echo": DB_ECHO, "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": DB_POOL_PRE_PING}
+    # SQLite picks its own pool class, which doesn't take size limits
+    if not url.startswith("sqlite"):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+class ReadOnlySession(Session):
+    """Session for replica reads; refuses to flush ORM changes."""
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            raise RuntimeError("Read-only session can't write; use get_session for this route")
+        super().flush(objects)
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+read_engine = engine if DATABASE_READ_URL == DATABASE_URL else create_async_engine(DATABASE_READ_URL, **_engine_options(DATABASE_READ_URL))
+async_read_session = async_sessionmaker(read_engine, class_=AsyncSession, sync_session_class=ReadOnlySession, expire_on_commit=False)
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """get_session for read-only routes (lists, exports, analytics), served by the replica."""
+    async with async_read_session() as session:
+        yield session
+
+def dialect_insert(model):
+    """INSERT construct for the active dialect, so callers can use ON CONFLICT clauses."""
+    if engine.dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
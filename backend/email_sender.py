@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import insert, update
+from sqlmodel import select
+from database import async_session
+from models import EmailCampaign, EmailLog, EmailSendJob, FollowUpEmail, Lead, Notification, User
+from usage import record_usage
+from rollups import EMAIL, record_events
+from jobs import job_handler
+from scheduler import mark_follow_up_failed, schedule_next_follow_up, start_follow_up_sequence
+from templates import MessageTemplate, TemplateError
+from http_client import RetryPolicy, request
+from events import pubsub, user_topic
+
+APOLLO_SEND_URL = "https://api.apollo.io/v1/email/send"
+EMAIL_SEND_CONCURRENCY = int(os.getenv("EMAIL_SEND_CONCURRENCY", "10"))
+# EmailLog rows and job counters are written once per this many leads
+EMAIL_LOG_FLUSH_SIZE = int(os.getenv("EMAIL_LOG_FLUSH_SIZE", "100"))
+# A send isn't idempotent: read timeouts, 500, 502 and 504 may mean Apollo sent it
+# anyway, so only failures where the request never reached Apollo are retried
+APOLLO_SEND_RETRY = RetryPolicy(
+    attempts=2,
+    retry_statuses=(429, 503),
+    retry_errors=(httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout),
+)
+
+
+async def send_one(api_key: str, to_email: str, subject: str, body: str) -> Optional[str]:
+    """Send a single email through Apollo. Returns None on success or the error text."""
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    data = {"to": to_email, "subject": subject, "body": body}
+    try:
+        resp = await request("POST", APOLLO_SEND_URL, APOLLO_SEND_RETRY, json=data, headers=headers)
+    except httpx.RequestError as e:
+        return str(e)
+    if resp.status_code in [200, 201]:
+        return None
+    if resp.status_code == 429:
+        return "Apollo rate limit exceeded"
+    return resp.text or f"Apollo error: HTTP {resp.status_code}"
+
+
+async def run_email_send(job_id: int, lead_ids: List[int], personalization: Dict[str, dict], defaults: Optional[dict] = None):
+    """
+    Fan a campaign out to `lead_ids` with bounded concurrency, writing EmailLog
+    rows and job progress in batches. On a retry, leads already logged by an
+    earlier attempt are skipped, so at most one unflushed batch is re-sent.
+    Templates can use the lead's own fields, overridden by `personalization`,
+    with `defaults` for anything neither provides; a lead still missing a
+    variable is logged as failed. Completing the campaign's first send starts
+    its follow-up sequence; completing a follow-up schedules the next step.
+    """
+    async with async_session() as session:
+        job = await session.get(EmailSendJob, job_id)
+        if job.status == "completed":
+            return
+        campaign = await session.get(EmailCampaign, job.email_campaign_id)
+        user = await session.get(User, job.user_id)
+        api_key = user.appollo_api_key
+        if not api_key:
+            raise RuntimeError("Apollo API key missing for this user")
+        user_id, campaign_id, campaign_name = job.user_id, campaign.id, campaign.name
+        follow_up = await session.get(FollowUpEmail, job.follow_up_id) if job.follow_up_id else None
+        step = follow_up or campaign
+        try:
+            template = MessageTemplate(step.subject, step.body, defaults)
+        except TemplateError as e:
+            # Templates saved before validation existed can be unparseable; retrying won't help
+            logging.error(f"Email send {job_id} for campaign {campaign_id} has an invalid template: {e}")
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+            session.add(job)
+            if follow_up:
+                follow_up.status = "failed"
+                session.add(follow_up)
+            session.add(Notification(
+                user_id=user_id,
+                type="email_failed",
+                message=f"Campaign '{campaign_name}' wasn't sent: {e}",
+                created_at=datetime.utcnow()
+            ))
+            await session.commit()
+            pubsub.publish(user_topic(user_id, "notifications"))
+            return
+        query = select(
+            Lead.id, Lead.email, Lead.first_name, Lead.last_name, Lead.company, Lead.job_title
+        ).where(Lead.id.in_(lead_ids))
+        if job.started_at:
+            query = query.where(Lead.id.not_in(
+                select(EmailLog.lead_id).where(EmailLog.campaign_id == campaign_id, EmailLog.sent_at >= job.started_at)
+            ))
+        result = await session.execute(query)
+        queue: asyncio.Queue = asyncio.Queue()
+        for row in result.mappings().all():
+            queue.put_nowait(dict(row))
+        job.status = "running"
+        job.started_at = job.started_at or datetime.utcnow()
+        session.add(job)
+        await session.commit()
+
+        pending: List[dict] = []
+        counts = {"sent": job.sent, "failed": job.failed}
+        unflushed_sent = 0
+        flush_lock = asyncio.Lock()
+
+        async def flush(status: Optional[str] = None):
+            nonlocal unflushed_sent
+            async with flush_lock:
+                # Swap the buffers out before awaiting so concurrent appends aren't lost
+                rows = list(pending)
+                pending.clear()
+                sent_delta, unflushed_sent = unflushed_sent, 0
+                values = dict(counts)
+                if rows:
+                    await session.execute(insert(EmailLog), rows)
+                    await record_events(session, user_id, EMAIL, ((r["campaign_id"], r["sent_at"], r["status"]) for r in rows))
+                await record_usage(session, user_id, emails=sent_delta)
+                if status:
+                    values.update(status=status, finished_at=datetime.utcnow())
+                await session.execute(update(EmailSendJob).where(EmailSendJob.id == job_id).values(**values))
+                await session.commit()
+
+        async def worker():
+            nonlocal unflushed_sent
+            while True:
+                try:
+                    lead = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                lead_id, to_email = lead.pop("id"), lead.pop("email")
+                error = None
+                if not to_email or "@" not in to_email:
+                    error = "Missing or invalid email address"
+                else:
+                    subject, body, missing = template.render(lead, personalization.get(str(lead_id)))
+                    if missing:
+                        error = f"Missing personalization variable: {', '.join(missing)}"
+                    else:
+                        error = await send_one(api_key, to_email, subject, body)
+                status = "sent" if error is None else "failed"
+                pending.append({
+                    "campaign_id": campaign_id,
+                    "lead_id": lead_id,
+                    "to_email": to_email or "",
+                    "status": status,
+                    "sent_at": datetime.utcnow(),
+                    "error": error,
+                })
+                counts[status] += 1
+                if status == "sent":
+                    unflushed_sent += 1
+                if len(pending) >= EMAIL_LOG_FLUSH_SIZE:
+                    await flush()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(EMAIL_SEND_CONCURRENCY)))
+        except Exception:
+            # Keep the progress made so far; the job queue decides whether to retry
+            await flush()
+            raise
+
+        # Committed together with the final flush, so a retry of a completed
+        # send returns early above instead of advancing the sequence twice
+        now = datetime.utcnow()
+        if follow_up:
+            follow_up.status = "sent"
+            session.add(follow_up)
+            await schedule_next_follow_up(session, FollowUpEmail, FollowUpEmail.email_campaign_id, campaign_id, now)
+        else:
+            campaign.status = "sent"
+            session.add(campaign)
+            await start_follow_up_sequence(session, FollowUpEmail, FollowUpEmail.email_campaign_id, campaign_id, now)
+        await flush(status="completed")
+
+        # Notify user if any emails failed
+        if counts["failed"] > 0:
+            notification = Notification(
+                user_id=user_id,
+                type="email_failed",
+                message=f"{counts['failed']} emails failed to send in campaign '{campaign_name}'.",
+                created_at=datetime.utcnow()
+            )
+            session.add(notification)
+            await session.commit()
+            pubsub.publish(user_topic(user_id, "notifications"))
+
+
+async def _email_send_dead(payload: dict, error: str):
+    async with async_session() as session:
+        await session.execute(
+            update(EmailSendJob)
+            .where(EmailSendJob.id == payload["send_job_id"])
+            .values(status="failed", finished_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+@job_handler("email_send", on_dead=_email_send_dead)
+async def handle_email_send(payload: dict):
+    await run_email_send(payload["send_job_id"], payload["lead_ids"], payload.get("personalization", {}), payload.get("defaults"))
+
+
+async def _follow_up_email_dead(payload: dict, error: str):
+    await mark_follow_up_failed(FollowUpEmail, payload["follow_up_id"])
+    async with async_session() as session:
+        await session.execute(
+            update(EmailSendJob)
+            .where(EmailSendJob.follow_up_id == payload["follow_up_id"], EmailSendJob.status != "completed")
+            .values(status="failed", finished_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+@job_handler("follow_up_email", on_dead=_follow_up_email_dead)
+async def handle_follow_up_email(payload: dict):
+    """Send a dispatched follow-up to every lead the campaign reached, except those who replied."""
+    async with async_session() as session:
+        follow_up = await session.get(FollowUpEmail, payload["follow_up_id"])
+        if follow_up is None or follow_up.status != "dispatching":
+            return
+        campaign = await session.get(EmailCampaign, follow_up.email_campaign_id)
+        reached = select(EmailLog.lead_id).where(EmailLog.campaign_id == campaign.id, EmailLog.status == "sent")
+        result = await session.execute(select(Lead.id).where(Lead.id.in_(reached), Lead.status != "replied"))
+        lead_ids = result.scalars().all()
+        result = await session.execute(select(EmailSendJob).where(EmailSendJob.follow_up_id == follow_up.id))
+        job = result.scalars().first()
+        if job is None:
+            job = EmailSendJob(user_id=campaign.user_id, email_campaign_id=campaign.id, follow_up_id=follow_up.id, total=len(lead_ids))
+            session.add(job)
+            await session.commit()
+        job_id = job.id
+    await run_email_send(job_id, lead_ids, {})
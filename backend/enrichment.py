@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import update
+from sqlmodel import select
+from database import async_session
+from models import Lead, EnrichmentBatch, Notification, User
+from cache import TieredCache, MISSING
+from jobs import job_handler
+from http_client import RetryPolicy, request
+from events import pubsub, user_topic
+
+APOLLO_MATCH_URL = "https://api.apollo.io/v1/people/match"
+# Apollo rate limits are per API key, so each key gets its own bucket
+APOLLO_REQUESTS_PER_MINUTE = float(os.getenv("APOLLO_REQUESTS_PER_MINUTE", "120"))
+APOLLO_BURST = int(os.getenv("APOLLO_BURST", "10"))
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "8"))
+# Results and progress are written back once per this many processed leads
+ENRICH_FLUSH_SIZE = int(os.getenv("ENRICH_FLUSH_SIZE", "100"))
+APOLLO_MATCH_RETRY = RetryPolicy(attempts=3)
+
+# Found emails are stable, misses are worth re-checking sooner
+ENRICH_CACHE_HIT_TTL = float(os.getenv("ENRICH_CACHE_HIT_TTL", str(30 * 24 * 3600)))
+ENRICH_CACHE_MISS_TTL = float(os.getenv("ENRICH_CACHE_MISS_TTL", str(24 * 3600)))
+ENRICH_CACHE_MAX_ENTRIES = int(os.getenv("ENRICH_CACHE_MAX_ENTRIES", "10000"))
+
+# (first_name, last_name, company) -> {"email":..., "confidence":...}
+enrichment_cache = TieredCache("enrichment", max_entries=ENRICH_CACHE_MAX_ENTRIES)
+
+
+class EnrichmentError(Exception):
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, up to `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def bucket_for_key(api_key: str) -> TokenBucket:
+    # Keyed by a digest so raw API keys don't sit in a long-lived dict
+    digest = hashlib.sha256(api_key.encode()).hexdigest()
+    if digest not in _buckets:
+        _buckets[digest] = TokenBucket(APOLLO_REQUESTS_PER_MINUTE / 60, APOLLO_BURST)
+    return _buckets[digest]
+
+
+async def fetch_email(api_key: str, first_name: str, last_name: str, company: str) -> dict:
+    """
+    Look a person up with Apollo people/match. Returns {"email", "confidence"},
+    with email None when Apollo has no match. Raises EnrichmentError once
+    retries are exhausted.
+    """
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = {"first_name": first_name, "last_name": last_name, "company": company}
+    try:
+        resp = await request(
+            "POST", APOLLO_MATCH_URL, APOLLO_MATCH_RETRY,
+            before_attempt=bucket_for_key(api_key).acquire, json=payload, headers=headers
+        )
+    except httpx.RequestError as e:
+        logging.error(f"Apollo.io request error: {e}")
+        raise EnrichmentError(f"Apollo.io error: {e}")
+    # Errors must raise rather than fall through as "no match", or they'd be cached as misses
+    if resp.status_code == 429:
+        raise EnrichmentError("Apollo rate limit exceeded. Try later.", status_code=429)
+    if resp.status_code in (401, 403):
+        raise EnrichmentError("Apollo.io rejected the API key.", status_code=400)
+    if resp.status_code >= 400:
+        raise EnrichmentError(f"Apollo.io error: HTTP {resp.status_code}", status_code=502)
+    try:
+        data = resp.json()
+    except ValueError:
+        raise EnrichmentError(f"Apollo.io error: HTTP {resp.status_code}")
+    person = data.get("person") or {}
+    if person.get("email"):
+        return {"email": person["email"], "confidence": person.get("confidence", 0)}
+    return {"email": None, "confidence": None}
+
+
+async def lookup_email(api_key: str, first_name: str, last_name: str, company: str) -> Tuple[dict, bool]:
+    """fetch_email behind enrichment_cache. Returns (result, cached)."""
+    cache_key = [first_name, last_name, company]
+    cached = await enrichment_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached, True
+    result = await fetch_email(api_key, first_name, last_name, company)
+    ttl = ENRICH_CACHE_HIT_TTL if result["email"] else ENRICH_CACHE_MISS_TTL
+    await enrichment_cache.set(cache_key, result, ttl)
+    return result, False
+
+
+async def run_enrichment_batch(batch_id: int, lead_ids: List[int]):
+    """
+    Enrich the batch's leads that still lack an email under bounded
+    concurrency and write results back in bulk, updating the EnrichmentBatch
+    as it goes. Safe to re-run after a crash: leads enriched by an earlier
+    attempt already have an email and are skipped.
+    """
+    pending: List[dict] = []
+    flush_lock = asyncio.Lock()
+
+    async with async_session() as session:
+        batch = await session.get(EnrichmentBatch, batch_id)
+        user = await session.get(User, batch.user_id)
+        api_key, user_id = user.appollo_api_key, user.id
+        if not api_key:
+            raise EnrichmentError("Apollo API key not configured for this user")
+        result = await session.execute(
+            select(Lead.id, Lead.first_name, Lead.last_name, Lead.company)
+            .where(Lead.id.in_(lead_ids), (Lead.email == None) | (Lead.email == ""))
+            .order_by(Lead.id)
+        )
+        leads = result.all()
+        queue: asyncio.Queue = asyncio.Queue()
+        for lead in leads:
+            queue.put_nowait(tuple(lead))
+        already_done = batch.total - len(leads)
+        counts = {"processed": already_done, "enriched": already_done, "not_found": 0, "failed": 0}
+        batch.status = "running"
+        batch.processed, batch.enriched = already_done, already_done
+        session.add(batch)
+        await session.commit()
+
+        async def flush(status: Optional[str] = None):
+            async with flush_lock:
+                # Swap the buffer out before awaiting so concurrent appends aren't lost
+                rows = list(pending)
+                pending.clear()
+                values = dict(counts)
+                if rows:
+                    await session.execute(update(Lead), rows)
+                if status:
+                    values.update(status=status, finished_at=datetime.utcnow())
+                await session.execute(update(EnrichmentBatch).where(EnrichmentBatch.id == batch_id).values(**values))
+                await session.commit()
+
+        async def worker():
+            while True:
+                try:
+                    lead_id, first_name, last_name, company = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    result, _ = await lookup_email(api_key, first_name, last_name, company)
+                    if result["email"]:
+                        pending.append({"id": lead_id, "email": result["email"], "email_confidence": result["confidence"]})
+                        counts["enriched"] += 1
+                    else:
+                        counts["not_found"] += 1
+                except EnrichmentError as e:
+                    logging.error(f"Enrichment batch {batch_id} failed for lead {lead_id}: {e}")
+                    counts["failed"] += 1
+                counts["processed"] += 1
+                if counts["processed"] % ENRICH_FLUSH_SIZE == 0:
+                    await flush()
+
+        await session.execute(update(EnrichmentBatch).where(EnrichmentBatch.id == batch_id).values(status="running"))
+        await session.commit()
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(ENRICH_CONCURRENCY, len(leads)) or 1)))
+        except Exception:
+            # Keep the progress made so far; the job queue decides whether to retry
+            await flush()
+            raise
+        await flush(status="completed")
+
+        notification = Notification(
+            user_id=user_id,
+            type="enrichment_completed" if not counts["failed"] else "enrichment_failed",
+            message=f"Email enrichment finished: {counts['enriched']} found, {counts['not_found']} not found, {counts['failed']} failed.",
+            created_at=datetime.utcnow()
+        )
+        session.add(notification)
+        await session.commit()
+        pubsub.publish(user_topic(user_id, "notifications"))
+
+
+async def _enrich_batch_dead(payload: dict, error: str):
+    async with async_session() as session:
+        await session.execute(
+            update(EnrichmentBatch)
+            .where(EnrichmentBatch.id == payload["batch_id"])
+            .values(status="failed", finished_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+@job_handler("enrich_batch", on_dead=_enrich_batch_dead)
+async def handle_enrich_batch(payload: dict):
+    await run_enrichment_batch(payload["batch_id"], payload["lead_ids"])
@@ -0,0 +1,71 @@
+import asyncio
+import json
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Set
+
+# Per-subscriber backlog; a subscriber that falls further behind loses its oldest events
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class PubSub:
+    """
+    In-process topic fan-out for the event loop. Only reaches subscribers in
+    the same process, so consumers should treat an event as a hint and keep
+    the database as the source of truth.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.counters = {"published": 0, "delivered": 0, "dropped": 0}
+
+    def publish(self, topic: str, event: Any = None):
+        self.counters["published"] += 1
+        for queue in self._subscribers.get(topic, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.counters["dropped"] += 1
+            queue.put_nowait(event)
+            self.counters["delivered"] += 1
+
+    @asynccontextmanager
+    async def subscribe(self, topic: str):
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._subscribers[topic].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[topic].discard(queue)
+            if not self._subscribers[topic]:
+                del self._subscribers[topic]
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "topics": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+        }
+
+
+pubsub = PubSub()
+
+
+def user_topic(user_id: int, stream: str) -> str:
+    return f"user:{user_id}:{stream}"
+
+
+def sse_event(data: Any, event: Optional[str] = None, id: Optional[Any] = None) -> str:
+    """Format one Server-Sent Events message."""
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+# Sent on idle streams so proxies don't time the connection out
+SSE_KEEPALIVE = ": keepalive\n\n"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
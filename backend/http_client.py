@@ -0,0 +1,133 @@
+"""
+Shared outbound HTTP: one pooled httpx.AsyncClient per process and one retry
+policy. The API opens and closes the client with the app; workers and
+scripts get it lazily on first use.
+"""
+import asyncio
+import logging
+import os
+import random
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+# httpx only caps connections overall, so requests per host are capped here
+_host_slots: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST))
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    # Pooled connections belong to the loop that opened them
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client, _client_loop = _new_client(), loop
+        _host_slots.clear()
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter. 429 and 503 responses that carry
+    Retry-After wait that long instead, up to max_retry_after. Only transport
+    errors of the `retry_errors` types are retried.
+    """
+
+    def __init__(self, attempts: int = 3, base: float = 0.5, cap: float = 10.0,
+                 retry_statuses=(429, 500, 502, 503, 504), max_retry_after: float = 60.0,
+                 retry_errors=(httpx.RequestError,)):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_retry_after = max_retry_after
+        self.retry_errors = tuple(retry_errors)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        retry_after = _retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return self.backoff(attempt)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Retry-After as seconds; it may be given as a number or an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+DEFAULT_RETRY = RetryPolicy()
+
+
+async def request(method: str, url: str, policy: RetryPolicy = DEFAULT_RETRY,
+                  before_attempt: Optional[Callable[[], Awaitable]] = None, **kwargs) -> httpx.Response:
+    """
+    Send a request on the shared client, retrying the policy's transport
+    errors and retry statuses. Returns the last response, which may still be
+    a retryable status once attempts run out; raises the httpx.RequestError
+    of the last attempt, or of the first one that isn't retryable. `before_attempt` runs
+    before every attempt, e.g. to take a rate-limit token.
+    """
+    client = get_client()
+    slots = _host_slots[httpx.URL(url).host]
+    for attempt in range(policy.attempts):
+        last = attempt == policy.attempts - 1
+        if before_attempt:
+            await before_attempt()
+        try:
+            async with slots:
+                response = await client.request(method, url, **kwargs)
+        except httpx.RequestError as e:
+            if last or not isinstance(e, policy.retry_errors):
+                raise
+            logging.warning(f"{method} {url} failed ({e!r}), attempt {attempt + 1}/{policy.attempts}")
+            await asyncio.sleep(policy.backoff(attempt))
+            continue
+        if response.status_code not in policy.retry_statuses or last:
+            return response
+        logging.warning(f"{method} {url} returned {response.status_code}, attempt {attempt + 1}/{policy.attempts}")
+        await asyncio.sleep(policy.delay(attempt, response))
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import case, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from database import async_session
+from models import Job
+
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+
+# kind -> async handler(payload)
+HANDLERS: Dict[str, Callable[[dict], Awaitable[None]]] = {}
+# kind -> async callback(payload, error), run once a job is dead-lettered
+DEAD_LETTER_HANDLERS: Dict[str, Callable[[dict, str], Awaitable[None]]] = {}
+
+
+def job_handler(kind: str, on_dead: Optional[Callable[[dict, str], Awaitable[None]]] = None):
+    """Register an async function as the handler for jobs of `kind`."""
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        if on_dead:
+            DEAD_LETTER_HANDLERS[kind] = on_dead
+        return fn
+    return decorator
+
+
+async def _dead_lettered(kind: str, payload: str, error: str):
+    on_dead = DEAD_LETTER_HANDLERS.get(kind)
+    if on_dead:
+        try:
+            await on_dead(json.loads(payload), error)
+        except Exception:
+            logging.exception(f"Dead-letter callback failed for job kind {kind}")
+
+
+async def enqueue(session: AsyncSession, kind: str, payload: dict, run_at: Optional[datetime] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> Job:
+    """
+    Add a job inside the caller's transaction, so it only becomes visible to
+    workers if the caller commits.
+    """
+    job = Job(kind=kind, payload=json.dumps(payload), run_at=run_at or datetime.utcnow(), max_attempts=max_attempts)
+    session.add(job)
+    await session.flush()
+    return job
+
+
+async def claim_jobs(worker_id: str, limit: int) -> List[dict]:
+    """
+    Atomically claim up to `limit` due jobs. PostgreSQL uses FOR UPDATE SKIP
+    LOCKED so concurrent workers never block on or double-claim a row;
+    SQLite ignores the locking clause but serialises writers, which gives the
+    same guarantee for the single UPDATE.
+    """
+    now = datetime.utcnow()
+    candidates = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.run_at <= now)
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(Job)
+        .where(Job.id.in_(candidates))
+        .values(
+            status="running",
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+            attempts=Job.attempts + 1,
+        )
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)
+    )
+    async with async_session() as session:
+        result = await session.execute(stmt)
+        rows = result.mappings().all()
+        await session.commit()
+    return [dict(row) for row in rows]
+
+
+async def heartbeat(job_id: int, worker_id: str):
+    """Push the visibility timeout forward while a job is still running."""
+    async with async_session() as session:
+        await session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == "running")
+            .values(locked_until=datetime.utcnow() + timedelta(seconds=JOB_VISIBILITY_TIMEOUT))
+        )
+        await session.commit()
+
+
+async def complete_job(job_id: int, worker_id: str):
+    async with async_session() as session:
+        await session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.locked_by == worker_id)
+            .values(status="succeeded", locked_by=None, locked_until=None, finished_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1)))
+
+
+async def fail_job(job: dict, worker_id: str, error: str):
+    """Requeue with backoff, or dead-letter once max_attempts is used up."""
+    now = datetime.utcnow()
+    if job["attempts"] >= job["max_attempts"]:
+        values = {"status": "dead", "finished_at": now}
+        logging.error(f"Job {job['id']} ({job['kind']}) dead-lettered after {job['attempts']} attempts: {error}")
+    else:
+        values = {"status": "queued", "run_at": now + timedelta(seconds=retry_delay(job["attempts"]))}
+    async with async_session() as session:
+        result = await session.execute(
+            update(Job)
+            .where(Job.id == job["id"], Job.locked_by == worker_id)
+            .values(locked_by=None, locked_until=None, last_error=error[:2000], **values)
+        )
+        await session.commit()
+    if values["status"] == "dead" and result.rowcount:
+        await _dead_lettered(job["kind"], job["payload"], error)
+
+
+async def requeue_expired() -> int:
+    """Release jobs whose worker stopped heartbeating, dead-lettering those out of attempts."""
+    async with async_session() as session:
+        result = await session.execute(
+            update(Job)
+            .where(Job.status == "running", Job.locked_until < datetime.utcnow())
+            .values(
+                status=case((Job.attempts >= Job.max_attempts, "dead"), else_="queued"),
+                locked_by=None,
+                locked_until=None,
+                last_error="visibility timeout expired",
+            )
+            .returning(Job.kind, Job.payload, Job.status)
+            .execution_options(synchronize_session=False)
+        )
+        rows = result.all()
+        await session.commit()
+    for kind, payload, status in rows:
+        if status == "dead":
+            await _dead_lettered(kind, payload, "visibility timeout expired")
+    return len(rows)
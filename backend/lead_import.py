@@ -0,0 +1,116 @@
+import csv
+import io
+import os
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from models import Lead
+from database import dialect_insert
+
+REQUIRED_COLUMNS = {"first_name", "last_name", "company", "profile_url", "job_title"}
+
+# Rows per multi-row INSERT. Lead has 8 bound columns, so 1000 rows stays well
+# under the bind-parameter limits of both PostgreSQL and SQLite.
+IMPORT_CHUNK_SIZE = int(os.getenv("LEAD_IMPORT_CHUNK_SIZE", "1000"))
+# Only a sample of rejected rows is echoed back so the response stays small.
+MAX_REJECTED_SAMPLES = 50
+
+
+def open_csv_text(binary_file) -> io.TextIOWrapper:
+    """Decode an uploaded file lazily instead of reading it into memory."""
+    return io.TextIOWrapper(binary_file, encoding="utf-8-sig", errors="replace", newline="")
+
+
+def validate_row(row: dict) -> Optional[str]:
+    if None in row:
+        return "too many columns"
+    if any(value is None for value in row.values()):
+        return "too few columns"
+    if not row["first_name"].strip() or not row["last_name"].strip():
+        return "first_name and last_name are required"
+    return None
+
+
+def row_to_lead(row: dict, campaign_id: int) -> dict:
+    return {
+        "first_name": row["first_name"].strip(),
+        "last_name": row["last_name"].strip(),
+        "job_title": row["job_title"].strip(),
+        "company": row["company"].strip(),
+        "profile_url": row["profile_url"].strip(),
+        "status": "pending",
+        "campaign_id": campaign_id,
+    }
+
+
+def _read_chunk(reader: csv.DictReader, size: int) -> List[Tuple[int, dict]]:
+    chunk = []
+    for row in reader:
+        chunk.append((reader.line_num, row))
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+async def insert_leads(session: AsyncSession, values: List[dict]) -> int:
+    """
+    Multi-row INSERT that lets the uq_lead_campaign_identity constraint drop
+    duplicates. Returns the number of rows actually inserted.
+    """
+    stmt = dialect_insert(Lead).values(values).on_conflict_do_nothing().returning(Lead.id)
+    result = await session.execute(stmt)
+    return len(result.all())
+
+
+async def import_lead_rows(
+    session: AsyncSession,
+    reader: csv.DictReader,
+    campaign_id: int,
+    max_new: int,
+) -> dict:
+    """
+    Parse `reader` chunk by chunk and write each chunk with one multi-row INSERT.
+    Only one chunk of rows is held in memory at a time and deduplication happens
+    in the database. The caller commits.
+    """
+    started = time.perf_counter()
+    stats = {
+        "rows_processed": 0,
+        "leads_created": 0,
+        "duplicates": 0,
+        "rows_rejected": 0,
+        "rejected": [],
+        "limit_reached": False,
+    }
+    while not stats["limit_reached"]:
+        # csv parsing and file reads are blocking, keep them off the event loop
+        chunk = await run_in_threadpool(_read_chunk, reader, IMPORT_CHUNK_SIZE)
+        if not chunk:
+            break
+        values = []
+        for line_num, row in chunk:
+            stats["rows_processed"] += 1
+            error = validate_row(row)
+            if error:
+                stats["rows_rejected"] += 1
+                if len(stats["rejected"]) < MAX_REJECTED_SAMPLES:
+                    stats["rejected"].append({"line": line_num, "reason": error})
+                continue
+            values.append(row_to_lead(row, campaign_id))
+        # Duplicates don't count against the quota, so keep inserting slices
+        # sized to the remaining allowance until the chunk is used up.
+        while values:
+            remaining = max_new - stats["leads_created"]
+            if remaining <= 0:
+                stats["limit_reached"] = True
+                break
+            batch, values = values[:remaining], values[remaining:]
+            inserted = await insert_leads(session, batch)
+            stats["leads_created"] += inserted
+            stats["duplicates"] += len(batch) - inserted
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["rows_processed"] / elapsed, 1) if elapsed > 0 else None
+    return stats
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from cache import TieredCache, MISSING
+from database import async_session
+from http_client import RetryPolicy, request
+from lead_import import insert_leads
+from usage import record_usage
+
+APOLLO_SEARCH_URL = "https://api.apollo.io/api/v1/mixed_people/search"
+# Required for people search and harvesting; routes return 400 while it is unset
+APOLLO_SEARCH_API_KEY = os.getenv("APOLLO_SEARCH_API_KEY")
+APOLLO_SEARCH_RETRY = RetryPolicy(attempts=3)
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600)))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "500"))
+# Set to 0 to stop fetching page N+1 in the background when page N is served
+SEARCH_PREFETCH = os.getenv("SEARCH_PREFETCH", "1") == "1"
+MAX_PER_PAGE = 100
+# Pages fetched at once by a harvest, and the most one harvest may walk
+HARVEST_CONCURRENCY = int(os.getenv("HARVEST_CONCURRENCY", "3"))
+MAX_HARVEST_PAGES = int(os.getenv("MAX_HARVEST_PAGES", "50"))
+
+# normalized search payload -> Apollo response
+search_cache = TieredCache("apollo_search", max_entries=SEARCH_CACHE_MAX_ENTRIES)
+# One Apollo call per payload at a time, shared by requests and prefetches
+_inflight: Dict[str, asyncio.Task] = {}
+_prefetch_counters = {"started": 0, "failed": 0}
+
+
+class SearchError(Exception):
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _clean(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_clean(item) for item in value if _clean(item) not in ("", None)]
+    return value
+
+
+def build_payload(req: dict) -> dict:
+    """Apollo search payload from the /scrape-linkedin-leads request body."""
+    try:
+        page = max(int(req.get("page", 1)), 1)
+        per_page = min(max(int(req.get("per_page", 20)), 1), MAX_PER_PAGE)
+    except (TypeError, ValueError):
+        raise SearchError("page and per_page must be numbers", status_code=400)
+    payload = {"page": page, "per_page": per_page}
+    filters = {
+        "currentCompany": "q_organization_keywords",
+        "job_title": "person_titles",
+        "location": "person_locations",
+        "keywords": "q_keywords",
+        "industry": "industry_tag_ids",
+    }
+    for field, apollo_field in filters.items():
+        value = _clean(req.get(field))
+        if value:
+            payload[apollo_field] = value
+    return payload
+
+
+def cache_key(payload: dict) -> dict:
+    """Case and list order don't change Apollo's results, so they don't split the cache."""
+    key = {}
+    for field, value in payload.items():
+        if isinstance(value, str):
+            value = value.lower()
+        elif isinstance(value, list):
+            value = sorted(str(item).lower() for item in value)
+        key[field] = value
+    return key
+
+
+async def fetch_page(api_key: str, payload: dict) -> dict:
+    headers = {
+        "accept": "application/json",
+        "Cache-Control": "no-cache",
+        "Content-Type": "application/json",
+        "x-api-key": api_key,
+    }
+    try:
+        response = await request("POST", APOLLO_SEARCH_URL, APOLLO_SEARCH_RETRY, headers=headers, json=payload)
+    except httpx.RequestError as e:
+        logging.error(f"Apollo request error: {e}")
+        raise SearchError(f"Apollo request error: {e}")
+    if response.status_code == 429:
+        raise SearchError("Apollo rate limit exceeded.", status_code=429)
+    if response.status_code == 422:
+        err = response.json().get("message") or response.text
+        raise SearchError(f"Apollo error: {err}", status_code=422)
+    if response.status_code >= 400:
+        raise SearchError(f"Apollo error: HTTP {response.status_code}", status_code=502)
+    return response.json()
+
+
+async def _fetch_and_cache(api_key: str, payload: dict) -> dict:
+    data = await fetch_page(api_key, payload)
+    await search_cache.set(cache_key(payload), data, SEARCH_CACHE_TTL)
+    return data
+
+
+def _start_fetch(api_key: str, payload: dict) -> asyncio.Task:
+    key = search_cache.make_key(cache_key(payload))
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_fetch_and_cache(api_key, payload))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task
+
+
+def _prefetch_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        _prefetch_counters["failed"] += 1
+        logging.warning(f"Apollo search prefetch failed: {task.exception()}")
+
+
+async def _prefetch_next(api_key: str, payload: dict, data: dict):
+    pagination = data.get("pagination") or {}
+    total_pages = pagination.get("total_pages")
+    if total_pages is not None and payload["page"] >= total_pages:
+        return
+    next_payload = {**payload, "page": payload["page"] + 1}
+    if await search_cache.get(cache_key(next_payload)) is not MISSING:
+        return
+    _prefetch_counters["started"] += 1
+    _start_fetch(api_key, next_payload).add_done_callback(_prefetch_done)
+
+
+async def search(api_key: str, payload: dict, prefetch: bool = SEARCH_PREFETCH) -> Tuple[dict, bool]:
+    """
+    One page of Apollo people search behind search_cache. Returns
+    (response, cached). Serving a page also starts fetching the next one in
+    the background, so paging forward is usually a cache hit.
+    """
+    data = await search_cache.get(cache_key(payload))
+    cached = data is not MISSING
+    if not cached:
+        # Shielded so a disconnecting client doesn't cancel a fetch others may be waiting on
+        data = await asyncio.shield(_start_fetch(api_key, payload))
+    if prefetch:
+        await _prefetch_next(api_key, payload, data)
+    return data, cached
+
+
+def person_to_lead(person: dict, campaign_id: int) -> Optional[dict]:
+    """Lead row for an Apollo person, or None without a first and last name."""
+    first_name = _clean(person.get("first_name") or "")
+    last_name = _clean(person.get("last_name") or "")
+    if not first_name or not last_name:
+        return None
+    organization = person.get("organization") or {}
+    email = person.get("email")
+    # Apollo puts a placeholder address on people whose email is still locked
+    if not email or "@" not in email or "not_unlocked" in email:
+        email = None
+    return {
+        "first_name": first_name,
+        "last_name": last_name,
+        "job_title": _clean(person.get("title") or ""),
+        "company": _clean(organization.get("name") or person.get("organization_name") or ""),
+        "profile_url": person.get("linkedin_url") or "",
+        "status": "pending",
+        "email": email,
+        "campaign_id": campaign_id,
+    }
+
+
+async def _store_page(session, user_id: int, campaign_id: int, data: dict, totals: dict, max_new: int) -> dict:
+    """Insert one page of people, stopping at the plan allowance, and commit."""
+    people = (data.get("people") or []) + (data.get("contacts") or [])
+    page = {"people": len(people), "leads_created": 0, "duplicates": 0, "skipped": 0}
+    rows: List[dict] = []
+    for person in people:
+        row = person_to_lead(person, campaign_id)
+        if row is None:
+            page["skipped"] += 1
+        else:
+            rows.append(row)
+    # Duplicates don't count against the allowance, so keep inserting slices
+    # sized to what is left until the page is used up
+    while rows:
+        remaining = max_new - totals["leads_created"] - page["leads_created"]
+        if remaining <= 0:
+            totals["limit_reached"] = True
+            break
+        batch, rows = rows[:remaining], rows[remaining:]
+        inserted = await insert_leads(session, batch)
+        page["leads_created"] += inserted
+        page["duplicates"] += len(batch) - inserted
+    await record_usage(session, user_id, leads=page["leads_created"])
+    await session.commit()
+    for key in ("people", "leads_created", "duplicates", "skipped"):
+        totals[key] += page[key]
+    totals["pages"] += 1
+    return page
+
+
+async def harvest(api_key: str, payload: dict, pages: int, campaign_id: int, user_id: int, max_new: int) -> AsyncIterator[dict]:
+    """
+    Walk up to `pages` pages of a search from payload["page"], fetching
+    HARVEST_CONCURRENCY pages at a time through the search cache, and
+    insert the people as leads of `campaign_id`. Existing leads are skipped
+    by the Lead identity constraint. Each page is committed as it lands, so
+    a harvest cut short keeps what it stored. Yields progress events.
+    """
+    first_page = payload["page"]
+    totals = {"pages": 0, "people": 0, "leads_created": 0, "duplicates": 0, "skipped": 0, "limit_reached": False}
+    slots = asyncio.Semaphore(HARVEST_CONCURRENCY)
+
+    async def fetch(page: int) -> Tuple[int, dict]:
+        async with slots:
+            data, _ = await search(api_key, {**payload, "page": page}, prefetch=False)
+            return page, data
+
+    tasks: List[asyncio.Task] = []
+    try:
+        _, data = await fetch(first_page)
+        total_pages = (data.get("pagination") or {}).get("total_pages") or first_page
+        last_page = min(first_page + pages - 1, total_pages)
+        yield {"event": "started", "first_page": first_page, "last_page": last_page, "total_pages": total_pages}
+        tasks = [asyncio.create_task(fetch(page)) for page in range(first_page + 1, last_page + 1)]
+        async with async_session() as session:
+            page = first_page
+            pending = asyncio.as_completed(tasks)
+            while True:
+                stored = await _store_page(session, user_id, campaign_id, data, totals, max_new)
+                yield {"event": "page", "page": page, **stored}
+                if totals["limit_reached"]:
+                    break
+                try:
+                    page, data = await next(pending)
+                except StopIteration:
+                    break
+        yield {"event": "done", **totals}
+    except SearchError as e:
+        yield {"event": "error", "detail": str(e), "status_code": e.status_code, **totals}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def stats() -> dict:
+    return {**search_cache.stats(), "prefetches": dict(_prefetch_counters), "inflight": len(_inflight)}
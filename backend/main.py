@@ -1,9 +1,13 @@
 from fastapi import FastAPI
+import asyncio
+import os
 from fastapi.middleware.cors import CORSMiddleware
 from auth import router as auth_router
-from routers import leads_router, campaigns_router, logs_router, ai_router, activity_router, subscriptions_router, google_oauth
+from routers import leads_router, campaigns_router, logs_router, ai_router, activity_router, subscriptions_router, notifications_router, google_oauth
 from database import engine
 from models import SQLModel
+from ai_ledger import ledger
+from http_client import close_client, get_client
 
 app = FastAPI()
 
@@ -16,11 +20,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Set JOBS_EMBEDDED_WORKER=1 to process jobs inside the API process (local
+# development); production runs `python worker.py` separately.
+embedded_worker = None
+ledger_flusher = None
+
 # Create database tables
 @app.on_event("startup")
 async def startup():
+    global embedded_worker, ledger_flusher
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+    ledger_flusher = asyncio.create_task(ledger.run())
+    # Outbound HTTP shares one pooled client for the life of the app
+    get_client()
+    if os.getenv("JOBS_EMBEDDED_WORKER", "0") == "1":
+        from worker import Worker
+        embedded_worker = Worker()
+        asyncio.create_task(embedded_worker.run())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if embedded_worker:
+        embedded_worker.stop()
+    if ledger_flusher:
+        # Cancelling runs a final flush of buffered AI ledger entries
+        ledger_flusher.cancel()
+        await asyncio.gather(ledger_flusher, return_exceptions=True)
+    await close_client()
 
 # Include routers with /api prefix to match frontend expectations
 app.include_router(auth_router, prefix="/api")
@@ -30,6 +57,7 @@ app.include_router(logs_router, prefix="")
 app.include_router(ai_router, prefix="/api")
 app.include_router(activity_router, prefix="")
 app.include_router(subscriptions_router, prefix="/api")
+app.include_router(notifications_router, prefix="/api")
 app.include_router(google_oauth, prefix="/api")
 
 @app.get("/")
@@ -1,16 +1,19 @@
 
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import UniqueConstraint, Index
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date
 
 # Follow-up message model for LinkedIn Campaign
 class FollowUpMessage(SQLModel, table=True):
+    # The scheduler polls this index for due follow-ups
+    __table_args__ = (Index("ix_followupmessage_status_scheduled_at", "status", "scheduled_at"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     campaign_id: int = Field(foreign_key="campaign.id")
     body: str
     delay_days: int  # Number of days after main message or previous follow-up
     scheduled_at: Optional[datetime] = None  # Calculated when campaign is sent
-    status: str = Field(default="pending")  # pending, scheduled, sent, failed
+    status: str = Field(default="pending")  # pending, scheduled, dispatching, sent, failed
     created_at: datetime = Field(default_factory=datetime.utcnow)
     campaign: Optional["Campaign"] = Relationship()
 
@@ -32,7 +35,7 @@ class User(SQLModel, table=True):
 
 class Campaign(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
     name: str
     description: Optional[str] = None
     status: str = Field(default="draft")  # draft, active, paused, completed
@@ -41,6 +44,10 @@ class Campaign(SQLModel, table=True):
     leads: List["Lead"] = Relationship(back_populates="campaign")
 
 class Lead(SQLModel, table=True):
+    # Uploads rely on this to skip duplicates with INSERT ... ON CONFLICT DO NOTHING
+    __table_args__ = (
+        UniqueConstraint("campaign_id", "first_name", "last_name", "company", "profile_url", name="uq_lead_campaign_identity"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     first_name: str
     last_name: str
@@ -51,13 +58,16 @@ class Lead(SQLModel, table=True):
     message_text: Optional[str] = None
     email: Optional[str] = Field(default=None, index=True)
     email_confidence: Optional[int] = Field(default=None)
-    campaign_id: Optional[int] = Field(default=None, foreign_key="campaign.id", nullable=True)
+    campaign_id: Optional[int] = Field(default=None, foreign_key="campaign.id", nullable=True, index=True)
     campaign: Optional[Campaign] = Relationship(back_populates="leads")
     outreach_logs: List["OutreachLog"] = Relationship(back_populates="lead")
 
 class OutreachLog(SQLModel, table=True):
+    # Owner copied from the lead's campaign so the activity feed is one index scan
+    __table_args__ = (Index("ix_outreachlog_user_id_id", "user_id", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     lead_id: int = Field(foreign_key="lead.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
     status: str
     message: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
@@ -76,6 +86,8 @@ class EmailCampaign(SQLModel, table=True):
     logs: List["EmailLog"] = Relationship(back_populates="campaign")
 
 class EmailLog(SQLModel, table=True):
+    # Serves the campaign logs page: filter by status, newest first
+    __table_args__ = (Index("ix_emaillog_campaign_status_sent_at", "campaign_id", "status", "sent_at"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     campaign_id: int = Field(foreign_key="emailcampaign.id")
     lead_id: int = Field(foreign_key="lead.id")
@@ -90,19 +102,26 @@ class EmailLog(SQLModel, table=True):
 
 # Follow-up email model for EmailCampaign
 class FollowUpEmail(SQLModel, table=True):
+    # The scheduler polls this index for due follow-ups
+    __table_args__ = (Index("ix_followupemail_status_scheduled_at", "status", "scheduled_at"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     email_campaign_id: int = Field(foreign_key="emailcampaign.id")
     subject: str
     body: str
     delay_days: int  # Number of days after main email or previous follow-up
     scheduled_at: Optional[datetime] = None  # Calculated when campaign is sent
-    status: str = Field(default="pending")  # pending, scheduled, sent, failed
+    status: str = Field(default="pending")  # pending, scheduled, dispatching, sent, failed
     created_at: datetime = Field(default_factory=datetime.utcnow)
     email_campaign: Optional[EmailCampaign] = Relationship()
 
 
 # Internal Notification model
 class Notification(SQLModel, table=True):
+    # Newest-first pages by id, and unread counts without touching read rows
+    __table_args__ = (
+        Index("ix_notification_user_id_id", "user_id", "id"),
+        Index("ix_notification_user_id_read_created_at", "user_id", "read", "created_at"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     type: str  # e.g. campaign_completed, lead_updated, usage_limit
@@ -110,3 +129,127 @@ class Notification(SQLModel, table=True):
     read: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     user: Optional[User] = Relationship()
+
+
+# Incrementally maintained usage counters, updated in the same transaction as
+# the lead/email writes they count. period is "all" for lifetime totals or
+# "YYYY-MM" for the net changes made during that month.
+class UsageCounter(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("user_id", "period", name="uq_usage_user_period"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    period: str
+    leads_owned: int = Field(default=0)
+    messages_sent: int = Field(default=0)
+    emails_sent: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# Progress record for a background email enrichment run
+class EnrichmentBatch(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    status: str = Field(default="pending")  # pending, running, completed, failed
+    total: int = Field(default=0)
+    processed: int = Field(default=0)
+    enriched: int = Field(default=0)
+    not_found: int = Field(default=0)
+    failed: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+
+# Progress record for drafting AI messages for a campaign's leads
+class MessageGenerationBatch(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    campaign_id: int = Field(foreign_key="campaign.id")
+    status: str = Field(default="pending")  # pending, running, completed, failed
+    total: int = Field(default=0)
+    processed: int = Field(default=0)
+    generated: int = Field(default=0)
+    failed: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+
+# Shared second tier for cache.TieredCache. key is a hash of the cache key
+# parts and value is JSON text.
+class CacheEntry(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("namespace", "key", name="uq_cache_namespace_key"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    namespace: str
+    key: str
+    value: str
+    expires_at: datetime = Field(index=True)
+
+
+# Progress record for a background email campaign send
+class EmailSendJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    email_campaign_id: int = Field(foreign_key="emailcampaign.id", index=True)
+    # Set when this send is a follow-up step rather than the main email
+    follow_up_id: Optional[int] = Field(default=None, foreign_key="followupemail.id", index=True)
+    status: str = Field(default="pending")  # scheduled, pending, running, completed, failed
+    total: int = Field(default=0)
+    sent: int = Field(default=0)
+    failed: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+# Durable background job, claimed by worker.py. payload is JSON text.
+class Job(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_job_status_run_at", "status", "run_at"),
+        Index("ix_job_status_locked_until", "status", "locked_until"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    payload: str = Field(default="{}")
+    status: str = Field(default="queued")  # queued, running, succeeded, dead
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    run_at: datetime = Field(default_factory=datetime.utcnow)
+    locked_by: Optional[str] = None
+    locked_until: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+
+# Per-day campaign counters, updated in the same transaction as the EmailLog
+# and OutreachLog writes they count. channel is "email" (campaign_id is an
+# EmailCampaign) or "linkedin" (campaign_id is a Campaign).
+class CampaignDailyStat(SQLModel, table=True):
+    # Leading (user_id, day) so the performance chart is one index range scan
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "channel", "campaign_id", name="uq_campaign_daily_stat"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    day: date
+    channel: str
+    campaign_id: int
+    sent: int = Field(default=0)
+    delivered: int = Field(default=0)
+    opened: int = Field(default=0)
+    replied: int = Field(default=0)
+    failed: int = Field(default=0)
+
+
+# Append-only record of every AI completion, written in batches by ai_ledger
+class AICompletion(SQLModel, table=True):
+    # Per-user date ranges back both the usage report and the monthly quota count
+    __table_args__ = (Index("ix_aicompletion_user_created_at", "user_id", "created_at"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    kind: str  # message, stream, batch
+    model: str
+    outcome: str  # ok, error, cancelled
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    latency_ms: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
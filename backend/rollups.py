@@ -0,0 +1,113 @@
+"""
+Daily campaign performance rollups.
+
+Writers call record_events in the same transaction as their EmailLog or
+OutreachLog inserts. To (re)build the table from existing logs, run once
+while no sends are in progress:
+
+    python rollups.py --rebuild
+"""
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Iterable, Tuple
+
+from sqlalchemy import delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from database import async_session, dialect_insert
+from models import Campaign, CampaignDailyStat, EmailCampaign, EmailLog, Lead, OutreachLog
+
+EMAIL = "email"
+LINKEDIN = "linkedin"
+# Keeps multi-row upserts under SQLite's bound-parameter limit
+UPSERT_CHUNK_SIZE = 1000
+ROLLUP_COLUMNS = ("sent", "delivered", "opened", "replied", "failed")
+# Log status -> rollup column; statuses not listed aren't counted
+STATUS_COLUMNS = {
+    EMAIL: {"sent": "sent", "delivered": "delivered", "opened": "opened", "bounced": "failed", "failed": "failed"},
+    LINKEDIN: {"sent": "sent", "contacted": "sent", "accepted": "delivered", "connected": "delivered", "replied": "replied", "failed": "failed"},
+}
+
+
+def _as_date(value) -> date:
+    # func.date() gives a date on PostgreSQL and an ISO string on SQLite
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+async def _upsert(session: AsyncSession, totals: dict, replace: bool = False):
+    if not totals:
+        return
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [
+        {"user_id": user_id, "day": day, "channel": channel, "campaign_id": campaign_id,
+         **{column: counts.get(column, 0) for column in ROLLUP_COLUMNS}}
+        for (user_id, day, channel, campaign_id), counts in sorted(totals.items())
+    ]
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = dialect_insert(CampaignDailyStat).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        if not replace:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["user_id", "day", "channel", "campaign_id"],
+                set_={column: getattr(CampaignDailyStat, column) + getattr(stmt.excluded, column) for column in ROLLUP_COLUMNS},
+            )
+        await session.execute(stmt)
+
+
+async def record_events(session: AsyncSession, user_id: int, channel: str, events: Iterable[Tuple[int, datetime, str]]):
+    """
+    Fold (campaign_id, timestamp, status) log events into the daily rollup
+    with a single upsert, inside the caller's transaction.
+    """
+    columns = STATUS_COLUMNS[channel]
+    totals = defaultdict(Counter)
+    for campaign_id, at, status in events:
+        column = columns.get(status)
+        if column and campaign_id is not None and at is not None:
+            totals[(user_id, at.date(), channel, campaign_id)][column] += 1
+    await _upsert(session, totals)
+
+
+async def rebuild(session: AsyncSession) -> int:
+    """Recompute every rollup row from the logs with two GROUP BY scans. Does not commit."""
+    totals = defaultdict(Counter)
+    email_day = func.date(EmailLog.sent_at)
+    email_result = await session.execute(
+        select(EmailCampaign.user_id, EmailLog.campaign_id, email_day, EmailLog.status, func.count())
+        .join(EmailCampaign, EmailCampaign.id == EmailLog.campaign_id)
+        .where(EmailLog.sent_at != None)
+        .group_by(EmailCampaign.user_id, EmailLog.campaign_id, email_day, EmailLog.status)
+    )
+    outreach_day = func.date(OutreachLog.timestamp)
+    outreach_result = await session.execute(
+        select(Campaign.user_id, Lead.campaign_id, outreach_day, OutreachLog.status, func.count())
+        .join(Lead, Lead.id == OutreachLog.lead_id)
+        .join(Campaign, Campaign.id == Lead.campaign_id)
+        .group_by(Campaign.user_id, Lead.campaign_id, outreach_day, OutreachLog.status)
+    )
+    for channel, result in ((EMAIL, email_result), (LINKEDIN, outreach_result)):
+        for user_id, campaign_id, day, status, count in result.all():
+            column = STATUS_COLUMNS[channel].get(status)
+            if column:
+                totals[(user_id, _as_date(day), channel, campaign_id)][column] += count
+    await session.execute(delete(CampaignDailyStat))
+    await _upsert(session, totals, replace=True)
+    return len(totals)
+
+
+async def _main():
+    async with async_session() as session:
+        rows = await rebuild(session)
+        await session.commit()
+    print(f"Rebuilt {rows} campaign rollup rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Campaign performance rollups")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all rollups from the logs")
+    args = parser.parse_args()
+    if args.rebuild:
+        asyncio.run(_main())
+    else:
+        parser.print_help()
@@ -5,4 +5,5 @@ from .logs import router as logs_router
 from .ai import router as ai_router
 from .activity import router as activity_router
 from .subscriptions import router as subscriptions_router
+from .notifications import router as notifications_router
 from .google_oauth import google_oauth
@@ -1,48 +1,111 @@
-from fastapi import APIRouter, Depends
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlmodel import select
+from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import User, OutreachLog, Lead, Campaign
-from database import get_session
+from models import User, OutreachLog, Lead
+from database import get_session, get_read_session, async_session
 from auth_utils import get_current_user
+from events import pubsub, user_topic, sse_event, SSE_HEADERS, SSE_KEEPALIVE
+from ai_ledger import monthly_completions, quota_for
+import usage as usage_service
 
 router = APIRouter(prefix="/api", tags=["activity"])
 
-@router.get("/activity")
-async def get_activity(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
-    # Get user's outreach logs with lead information
-    result = await session.execute(
-        select(OutreachLog, Lead)
-        .join(Lead)
-        .join(Campaign)
-        .where(Campaign.user_id == user.id)
-        .order_by(OutreachLog.timestamp.desc())
-        .limit(50)
+MAX_ACTIVITY_PAGE_SIZE = 200
+# Idle streams send a keepalive and re-check the table this often, which
+# also picks up events logged by other processes
+ACTIVITY_STREAM_POLL_SECONDS = 15
+
+
+async def _fetch_activity(session: AsyncSession, user_id: int, limit: int, before: Optional[int] = None, after: Optional[int] = None):
+    query = (
+        select(OutreachLog.id, OutreachLog.status, OutreachLog.message, OutreachLog.timestamp, Lead.first_name, Lead.last_name)
+        .join(Lead, Lead.id == OutreachLog.lead_id)
+        .where(OutreachLog.user_id == user_id)
+        .limit(limit)
     )
-    
-    activities = []
-    for log, lead in result.all():
-        activities.append({
-            "id": str(log.id),
-            "action": f"Message {log.status}",
-            "lead": f"{lead.first_name} {lead.last_name}",
-            "timestamp": log.timestamp.isoformat(),
-            "status": log.status,
-            "message": log.message
-        })
-    
-    return activities
+    if after is not None:
+        query = query.where(OutreachLog.id > after).order_by(OutreachLog.id)
+    else:
+        query = query.order_by(OutreachLog.id.desc())
+        if before is not None:
+            query = query.where(OutreachLog.id < before)
+    result = await session.execute(query)
+    return [
+        {
+            "id": str(row.id),
+            "action": f"Message {row.status}",
+            "lead": f"{row.first_name} {row.last_name}",
+            "timestamp": row.timestamp.isoformat(),
+            "status": row.status,
+            "message": row.message
+        }
+        for row in result.all()
+    ]
+
+
+@router.get("/activity")
+async def get_activity(
+    before: Optional[int] = Query(None, description="Only return entries older than this id"),
+    limit: int = Query(50, ge=1, le=MAX_ACTIVITY_PAGE_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+    user: User = Depends(get_current_user)
+):
+    """Newest-first outreach activity. For the next page pass the last entry's id as `before`."""
+    return await _fetch_activity(session, user.id, limit, before=before)
+
+
+async def _activity_events(request: Request, user_id: int, last_id: Optional[int]):
+    # Reads go to the primary, since a wakeup follows a commit the replica may
+    # not have yet. Subscribe before reading so nothing logged in between is missed
+    async with pubsub.subscribe(user_topic(user_id, "activity")) as wakeups:
+        if last_id is None:
+            async with async_session() as session:
+                result = await session.execute(select(func.max(OutreachLog.id)).where(OutreachLog.user_id == user_id))
+                last_id = result.scalar_one_or_none() or 0
+        while not await request.is_disconnected():
+            while True:
+                async with async_session() as session:
+                    items = await _fetch_activity(session, user_id, MAX_ACTIVITY_PAGE_SIZE, after=last_id)
+                for item in items:
+                    yield sse_event(item, event="activity", id=item["id"])
+                if items:
+                    last_id = int(items[-1]["id"])
+                if len(items) < MAX_ACTIVITY_PAGE_SIZE:
+                    break
+            try:
+                await asyncio.wait_for(wakeups.get(), ACTIVITY_STREAM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                yield SSE_KEEPALIVE
+            # One read covers every event that arrived meanwhile
+            while not wakeups.empty():
+                wakeups.get_nowait()
+
+
+@router.get("/activity/stream")
+async def stream_activity(
+    request: Request,
+    after: Optional[int] = Query(None, description="Replay entries newer than this id first"),
+    last_event_id: Optional[int] = Header(None),
+    user: User = Depends(get_current_user)
+):
+    """
+    Server-Sent Events stream of new outreach activity. Reconnecting clients
+    resume from Last-Event-ID; otherwise only entries logged after connecting
+    are sent.
+    """
+    start = last_event_id if last_event_id is not None else after
+    return StreamingResponse(_activity_events(request, user.id, start), media_type="text/event-stream", headers=SSE_HEADERS)
+
 
 @router.get("/usage")
 async def get_usage(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
     # Get user's actual usage statistics
-    leads_result = await session.exec(
-        select(Lead)
-        .join(Campaign)
-        .where(Campaign.user_id == user.id)
-    )
-    leads = leads_result.all()
-    
-    messages_sent = len([lead for lead in leads if lead.status in ["contacted", "sent", "replied", "connected"]])
+    usage = await usage_service.get_usage(session, user.id)
     
     # Subscription limits
     limits = {
@@ -55,9 +118,12 @@ async def get_usage(session: AsyncSession = Depends(get_session), user: User = D
     
     return {
         "subscription_tier": user.subscription_tier,
-        "leads_used": len(leads),
+        "leads_used": usage["leads_owned"],
         "leads_limit": user_limits["leads"],
-        "messages_sent": messages_sent,
+        "messages_sent": usage["messages_sent"],
         "messages_limit": user_limits["messages"],
-        "remaining": user_limits["leads"] - len(leads)
+        "emails_sent": usage["emails_sent"],
+        "ai_messages_used": await monthly_completions(user.id),
+        "ai_messages_limit": quota_for(user.subscription_tier),
+        "remaining": user_limits["leads"] - usage["leads_owned"]
     }
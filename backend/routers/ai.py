@@ -1,73 +1,195 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Lead, User
-from database import get_session
+from openai import OpenAIError
+from models import Campaign, Lead, MessageGenerationBatch, User
+from database import get_session, get_read_session
 from auth_utils import get_current_user
-from schemas import MessageGenRequest, MessageGenResponse
-import openai
-import os
+from schemas import MessageGenResponse
+from jobs import enqueue
+from events import sse_event, SSE_HEADERS
+from ai_ledger import AIQuotaExceeded, check_quota, monthly_completions, quota_for, usage_report, month_start
+import ai_messages
 
-router = APIRouter(tags=["ai"])
-
-openai.api_key = os.environ.get("OPENAI_API_KEY", "sk-xxx")
-
-PROMPT_TEMPLATE = """
-Write a personalized LinkedIn outreach message for the following lead:
-First Name: {first_name}
-Last Name: {last_name}
-Job Title: {job_title}
-Company: {company}
-Profile URL: {profile_url}
-"""
+# Longest /ai-usage range; the report aggregates raw ledger rows
+MAX_AI_USAGE_DAYS = 92
+AI_USAGE_DEFAULT_DAYS = 30
 
+router = APIRouter(tags=["ai"])
 
 
-@router.post("/generate-message", response_model=MessageGenResponse)
-async def generate_message(req: dict, session: AsyncSession = Depends(get_session)):
+def _parse_request(req: dict):
     lead_info = req.get("leadInfo", "").strip()
-    tone = req.get("tone", "professional")
-    goal = req.get("goal", "connect")  # e.g., connect, pitch, invite
-    length = req.get("length", 300)  # preferred max length in characters
-    cta = req.get("cta", "")  # optional call-to-action
-    personalization = req.get("personalization", "")  # shared interests, tags
-    msg_type = req.get("type", "linkedin")  # 'linkedin' or 'email'
-
     if not lead_info:
         raise HTTPException(status_code=400, detail="Lead information is required")
-
-    if not openai.api_key or openai.api_key == "sk-xxx":
+    try:
+        options = ai_messages.message_options(req)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="length must be a number")
+    if not ai_messages.ai_configured():
         raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    return lead_info, options
+
 
+@router.post("/generate-message", response_model=MessageGenResponse)
+async def generate_message(req: dict, user: User = Depends(get_current_user)):
+    """
+    Identical requests are answered from the message cache; send
+    bypassCache: true to force a fresh draft.
+    """
+    lead_info, options = _parse_request(req)
     try:
-        if msg_type == "email":
-            persona = "You are an expert email marketer with a proven track record in crafting high-converting cold email campaigns for B2B clients."
-            prompt = (
-                f"{persona} "
-                f"Write a {tone} email outreach message for the following campaign: {lead_info}. "
-                f"Goal: {goal}. "
-                f"Personalization: {personalization}. "
-                f"Include this call-to-action if provided: {cta}. "
-                f"Keep it professional, personalized, and under {length} characters."
-            )
-        else:
-            persona = "You are a seasoned LinkedIn outreach specialist, skilled in building professional relationships and starting meaningful conversations through LinkedIn messaging."
-            prompt = (
-                f"{persona} "
-                f"Write a {tone} LinkedIn outreach message for the following campaign: {lead_info}. "
-                f"Goal: {goal}. "
-                f"Personalization: {personalization}. "
-                f"Include this call-to-action if provided: {cta}. "
-                f"Keep it professional, personalized, and under {length} characters."
-            )
-
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=round(length * 0.7),
-            temperature=0.7
+        message, cached = await ai_messages.generate_cached(
+            user.id, user.subscription_tier, lead_info, options, bypass=bool(req.get("bypassCache", False))
         )
-        message = response.choices[0].message.content.strip()
-        return {"message": message}
+        return {"message": message, "cached": cached}
+    except AIQuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate message: {str(e)}")
+
+
+@router.post("/generate-message/stream")
+async def generate_message_stream(req: dict, user: User = Depends(get_current_user)):
+    """
+    Same request body as /generate-message, answered as Server-Sent Events:
+    `token` events carry text as it is generated, then one `done` event with
+    the full message, or an `error` event. A cache hit arrives as a single
+    token event.
+    """
+    lead_info, options = _parse_request(req)
+    if req.get("bypassCache", False):
+        ai_messages.count_cache_event(user.id, "bypassed")
+    else:
+        message = await ai_messages.cached_message(user.id, lead_info, options)
+        if message is not None:
+            cached_events = [
+                sse_event({"delta": message}, event="token"),
+                sse_event({"message": message, "cached": True}, event="done"),
+            ]
+            return StreamingResponse(iter(cached_events), media_type="text/event-stream", headers=SSE_HEADERS)
+    try:
+        await check_quota(user.id, user.subscription_tier)
+    except AIQuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    async def events():
+        parts = []
+        try:
+            async for delta in ai_messages.stream_message(user.id, lead_info, options):
+                parts.append(delta)
+                yield sse_event({"delta": delta}, event="token")
+        except OpenAIError as e:
+            yield sse_event({"detail": f"Failed to generate message: {str(e)}"}, event="error")
+            return
+        message = "".join(parts).strip()
+        await ai_messages.store_message(user.id, lead_info, options, message)
+        yield sse_event({"message": message, "cached": False}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/message-cache/stats")
+async def message_cache_stats(user: User = Depends(get_current_user)):
+    """This worker's message cache counters, plus the caller's own hits and misses"""
+    return ai_messages.cache_stats(user.id)
+
+
+@router.post("/campaigns/{campaign_id}/generate-messages")
+async def generate_campaign_messages(
+    campaign_id: int,
+    req: dict = Body(default={}),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(get_current_user)
+):
+    """
+    Queue AI drafts for every lead in a campaign, saved to each lead's
+    message_text. Takes the /generate-message options; leads that already
+    have a draft are skipped unless req["overwrite"] is true.
+    """
+    try:
+        options = ai_messages.message_options(req)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="length must be a number")
+    if not ai_messages.ai_configured():
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    result = await session.execute(select(Campaign.id).where(Campaign.id == campaign_id, Campaign.user_id == user.id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    try:
+        await check_quota(user.id, user.subscription_tier)
+    except AIQuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    overwrite = bool(req.get("overwrite", False))
+    query = select(Lead.id).where(Lead.campaign_id == campaign_id).order_by(Lead.id)
+    if not overwrite:
+        query = query.where((Lead.message_text == None) | (Lead.message_text == ""))
+    lead_ids = (await session.execute(query)).scalars().all()
+
+    batch = MessageGenerationBatch(user_id=user.id, campaign_id=campaign_id, total=len(lead_ids))
+    session.add(batch)
+    await session.flush()
+    await enqueue(session, "generate_messages", {
+        "batch_id": batch.id,
+        "lead_ids": lead_ids,
+        "options": options,
+        "overwrite": overwrite
+    })
+    await session.commit()
+    await session.refresh(batch)
+    return {"batch_id": batch.id, "total": batch.total, "status": batch.status}
+
+
+@router.get("/message-batches/{batch_id}")
+async def get_message_batch(batch_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    result = await session.execute(
+        select(MessageGenerationBatch).where(MessageGenerationBatch.id == batch_id, MessageGenerationBatch.user_id == user.id)
+    )
+    batch = result.scalar_one_or_none()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Message batch not found")
+    return {
+        "batch_id": batch.id,
+        "campaign_id": batch.campaign_id,
+        "status": batch.status,
+        "total": batch.total,
+        "processed": batch.processed,
+        "generated": batch.generated,
+        "failed": batch.failed,
+        "created_at": batch.created_at,
+        "finished_at": batch.finished_at
+    }
+
+
+@router.get("/ai-usage")
+async def get_ai_usage(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    session: AsyncSession = Depends(get_read_session),
+    user: User = Depends(get_current_user)
+):
+    """
+    The caller's AI completions per day: tokens, estimated cost and latency
+    percentiles, plus this month's quota. Defaults to the last 30 days.
+    """
+    to_date = to_date or datetime.utcnow().date()
+    from_date = from_date or to_date - timedelta(days=AI_USAGE_DEFAULT_DAYS - 1)
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (to_date - from_date).days >= MAX_AI_USAGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must be at most {MAX_AI_USAGE_DAYS} days")
+    report = await usage_report(session, from_date, to_date, user_id=user.id)
+    limit = quota_for(user.subscription_tier)
+    used = await monthly_completions(user.id)
+    report["quota"] = {
+        "tier": user.subscription_tier,
+        "period": month_start().strftime("%Y-%m"),
+        "limit": limit,
+        "used": used,
+        "remaining": max(limit - used, 0),
+    }
+    return report
@@ -1,52 +1,57 @@
 
-from fastapi import APIRouter, Depends, HTTPException, Body, Path, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Body, Path, Query, BackgroundTasks
 from sqlmodel import select
+from sqlalchemy import and_, func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Campaign, Lead, User, EmailCampaign, EmailLog, FollowUpEmail, FollowUpMessage
-from database import get_session, async_session
+from typing import Optional
+from models import Campaign, CampaignDailyStat, Lead, User, EmailCampaign, EmailLog, EmailSendJob, FollowUpEmail, FollowUpMessage
+from rollups import ROLLUP_COLUMNS, STATUS_COLUMNS
+from database import get_session, get_read_session, async_session
 from auth_utils import get_current_user
+from jobs import enqueue
+from templates import LEAD_VARIABLES, MessageTemplate, TemplateError, validate as validate_templates, validate_follow_ups
 from schemas import CampaignStats, EmailCampaignCreate
-from datetime import datetime, timedelta 
+from datetime import date, datetime, timedelta 
 import os
 import logging 
-import requests
 from schemas import CampaignCreate, FollowUpMessageCreate
 from models import FollowUpMessage 
 
 
 router = APIRouter(prefix="/api", tags=["campaigns"])
 
+PERFORMANCE_DEFAULT_DAYS = 30
+MAX_LOGS_PAGE_SIZE = 500
+
 @router.get("/email-campaigns/performance")
-async def email_campaign_performance(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
-    # Aggregate sent and responses per day for user's campaigns
-    result = await session.execute(
-        select(Lead)
-        .join(Campaign)
-        .where(Campaign.user_id == user.id)
+async def email_campaign_performance(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    channel: Optional[str] = Query(None, description="email or linkedin; both when omitted"),
+    session: AsyncSession = Depends(get_read_session),
+    user: User = Depends(get_current_user)
+):
+    """Daily sent/delivered/opened/replied/failed counts from the rollup table. Defaults to the last 30 days."""
+    to_date = to_date or datetime.utcnow().date()
+    from_date = from_date or to_date - timedelta(days=PERFORMANCE_DEFAULT_DAYS - 1)
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if channel is not None and channel not in STATUS_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"channel must be one of: {', '.join(STATUS_COLUMNS)}")
+
+    query = (
+        select(CampaignDailyStat.day, *(func.sum(getattr(CampaignDailyStat, c)).label(c) for c in ROLLUP_COLUMNS))
+        .where(CampaignDailyStat.user_id == user.id, CampaignDailyStat.day >= from_date, CampaignDailyStat.day <= to_date)
+        .group_by(CampaignDailyStat.day)
+        .order_by(CampaignDailyStat.day)
     )
-    leads = result.scalars().all()
-    # Group by date
-    performance = {}
-    for lead in leads:
-        # Use sent_date or created_at as the date
-        date = None
-        if hasattr(lead, "sent_date") and lead.sent_date:
-            date = lead.sent_date.date().isoformat()
-        elif hasattr(lead, "created_at") and lead.created_at:
-            date = lead.created_at.date().isoformat()
-        else:
-            continue
-        if date not in performance:
-            performance[date] = {"sent": 0, "responses": 0}
-        if lead.status in ["contacted", "sent"]:
-            performance[date]["sent"] += 1
-        if lead.status == "replied":
-            performance[date]["responses"] += 1
-    # Convert to sorted list
-    chart_data = [
-        {"date": date, "sent": perf["sent"], "responses": perf["responses"]}
-        for date, perf in sorted(performance.items())
-    ]
+    if channel:
+        query = query.where(CampaignDailyStat.channel == channel)
+    result = await session.execute(query)
+    chart_data = []
+    for row in result.mappings().all():
+        counts = {c: row[c] or 0 for c in ROLLUP_COLUMNS}
+        chart_data.append({"date": row["day"].isoformat(), **counts, "responses": counts["replied"]})
     return chart_data
 
 
@@ -59,6 +64,15 @@ async def create_email_campaign(
     session: AsyncSession = Depends(get_session),
     user: User = Depends(get_current_user)
 ):
+    follow_up_templates = {}
+    for i, follow_up in enumerate(req.follow_ups or [], 1):
+        follow_up_templates[f"follow-up {i} subject"] = follow_up.subject
+        follow_up_templates[f"follow-up {i} body"] = follow_up.body
+    try:
+        checked = validate_templates(subject=req.subject, body=req.body)
+        validate_follow_ups(**follow_up_templates)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     campaign = EmailCampaign(
         user_id=user.id,
         name=req.name,
@@ -67,13 +81,22 @@ async def create_email_campaign(
         status="draft"
     )
     session.add(campaign)
+    await session.flush()
+    # Follow-ups stay pending until the previous step has been sent
+    for follow_up in req.follow_ups or []:
+        session.add(FollowUpEmail(
+            email_campaign_id=campaign.id,
+            subject=follow_up.subject,
+            body=follow_up.body,
+            delay_days=follow_up.delay_days
+        ))
     await session.commit()
     await session.refresh(campaign)
 
-    return {"id": campaign.id, "message": "Email campaign created"}
+    return {"id": campaign.id, "message": "Email campaign created", **checked}
 
 @router.get("/email-campaigns")
-async def list_email_campaigns(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+async def list_email_campaigns(session: AsyncSession = Depends(get_read_session), user: User = Depends(get_current_user)):
     result = await session.execute(select(EmailCampaign).where(EmailCampaign.user_id == user.id))
     campaigns = result.scalars().all()
     return [
@@ -88,6 +111,81 @@ async def list_email_campaigns(session: AsyncSession = Depends(get_session), use
         } for c in campaigns
     ]
 
+async def _campaign_template(session: AsyncSession, user: User, campaign_id: int, req: dict):
+    """The user's campaign, its compiled template with req["defaults"], and the requested leads' template values."""
+    result = await session.execute(
+        select(EmailCampaign).where(EmailCampaign.id == campaign_id, EmailCampaign.user_id == user.id)
+    )
+    campaign = result.scalar_one_or_none()
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Email campaign not found")
+    defaults = req.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        raise HTTPException(status_code=400, detail="defaults must be an object of variable values")
+    try:
+        template = MessageTemplate(campaign.subject, campaign.body, defaults)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Only the user's own leads can be sent to
+    leads_result = await session.execute(
+        select(Lead.id, *(getattr(Lead, name) for name in LEAD_VARIABLES))
+        .join(Campaign)
+        .where(Lead.id.in_(req.get("leadIds", [])), Campaign.user_id == user.id)
+    )
+    leads = [dict(row) for row in leads_result.mappings().all()]
+    return campaign, template, leads
+
+
+async def _queue_send(session: AsyncSession, user: User, campaign_id: int, req: dict, run_at: datetime = None):
+    # Make sure user has Apollo API key
+    APOLLO_API_KEY = user.appollo_api_key
+    if not APOLLO_API_KEY:
+        raise HTTPException(status_code=500, detail="Apollo API key missing for this user")
+
+    campaign, template, leads = await _campaign_template(session, user, campaign_id, req)
+    personalization = req.get("personalization", {})
+    report = template.report(leads, personalization)
+    lead_ids = [lead["id"] for lead in leads]
+
+    job = EmailSendJob(
+        user_id=user.id,
+        email_campaign_id=campaign.id,
+        total=len(lead_ids),
+        status="scheduled" if run_at else "pending"
+    )
+    session.add(job)
+    await session.flush()
+    await enqueue(session, "email_send", {
+        "send_job_id": job.id,
+        "lead_ids": lead_ids,
+        "personalization": personalization,
+        "defaults": template.defaults
+    }, run_at=run_at)
+    if run_at:
+        campaign.status = "scheduled"
+        campaign.scheduled_at = run_at
+        session.add(campaign)
+    await session.commit()
+    await session.refresh(job)
+    return job, report
+
+
+@router.post("/email-campaigns/{campaign_id}/template-check")
+async def check_email_campaign_template(
+    campaign_id: int,
+    req: dict = Body(...),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(get_current_user)
+):
+    """
+    Dry run of /send's personalization: same body, nothing is queued.
+    Reports how many leads are missing template variables, and which.
+    """
+    _, template, leads = await _campaign_template(session, user, campaign_id, req)
+    return template.report(leads, req.get("personalization", {}))
+
+
 @router.post("/email-campaigns/{campaign_id}/send")
 async def send_email_campaign(
     campaign_id: int,
@@ -96,145 +194,148 @@ async def send_email_campaign(
     user: User = Depends(get_current_user)
 ):
     """
-    Send an email campaign to leads using Apollo.io API.
+    Queue an email campaign send to leads using Apollo.io API and return a job id.
     req["leadIds"]: list of lead IDs
     req["personalization"]: {leadId: {var: value}}
+    req["defaults"]: {var: value} for leads that have no value of their own
+    The response's template_report counts leads whose emails will fail for
+    missing variables.
     """
+    job, report = await _queue_send(session, user, campaign_id, req)
+    return {
+        "message": f"Queued {job.total} emails",
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "template_report": report
+    }
 
-    # Make sure user has Apollo API key
-    APOLLO_API_KEY = user.apollo_api_key
-    if not APOLLO_API_KEY:
-        raise HTTPException(status_code=500, detail="Apollo API key missing for this user")
 
-    # Fetch campaign
+@router.post("/email-campaigns/{campaign_id}/schedule")
+async def schedule_email_campaign(
+    campaign_id: int,
+    req: dict = Body(...),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(get_current_user)
+):
+    """
+    Like /send, but the job queue holds the send until req["scheduledAt"]
+    (ISO 8601, UTC if no offset is given).
+    """
+    try:
+        run_at = datetime.fromisoformat(str(req.get("scheduledAt")).replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="scheduledAt must be an ISO 8601 datetime")
+    if run_at.tzinfo:
+        run_at = (run_at - run_at.utcoffset()).replace(tzinfo=None)
+    if run_at <= datetime.utcnow():
+        raise HTTPException(status_code=400, detail="scheduledAt must be in the future")
+
+    job, report = await _queue_send(session, user, campaign_id, req, run_at=run_at)
+    return {
+        "message": f"Scheduled {job.total} emails for {run_at.isoformat()}",
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "scheduled_at": run_at,
+        "template_report": report
+    }
+
+
+@router.get("/email-campaigns/{campaign_id}/send-jobs/{job_id}")
+async def get_email_send_job(campaign_id: int, job_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
     result = await session.execute(
-        select(EmailCampaign).where(EmailCampaign.id == campaign_id, EmailCampaign.user_id == user.id)
+        select(EmailSendJob).where(
+            EmailSendJob.id == job_id,
+            EmailSendJob.email_campaign_id == campaign_id,
+            EmailSendJob.user_id == user.id
+        )
     )
-    campaign = result.scalar_one_or_none()
-    if not campaign:
+    job = result.scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail="Send job not found")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "sent": job.sent,
+        "failed": job.failed,
+        "pending": max(0, job.total - job.sent - job.failed),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+@router.get("/email-campaigns/{campaign_id}/logs")
+async def get_email_campaign_logs(
+    campaign_id: int,
+    cursor: Optional[str] = None,
+    page_size: int = Query(100, ge=1, le=MAX_LOGS_PAGE_SIZE),
+    status: Optional[str] = Query(None, description="Comma-separated statuses"),
+    session: AsyncSession = Depends(get_read_session),
+    user: User = Depends(get_current_user)
+):
+    """
+    Newest-first, keyset-paginated send log with lead names, plus per-status
+    counts for the whole campaign. Pass the returned `next_cursor` as
+    `cursor` to get the next page.
+    """
+    result = await session.execute(select(EmailCampaign.id).where(EmailCampaign.id == campaign_id, EmailCampaign.user_id == user.id))
+    if result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Email campaign not found")
 
-    # Fetch leads
-    leads_result = await session.execute(select(Lead).where(Lead.id.in_(req["leadIds"])))
-    leads = leads_result.scalars().all()
-
-    logs = []
-    failed_count = 0
-
-    for lead in leads:
-        # Personalize subject/body
-        vars = req.get("personalization", {}).get(str(lead.id), {})
-        subject = campaign.subject.format(**vars)
-        body = campaign.body.format(**vars)
-
-        # Validate email
-        to_email = getattr(lead, "email", None)
-        if not to_email or "@" not in to_email:
-            status = "failed"
-            error = "Missing or invalid email address"
-            failed_count += 1
-            log = EmailLog(
-                campaign_id=campaign.id,
-                lead_id=lead.id,
-                to_email=to_email or "",
-                status=status,
-                sent_at=datetime.utcnow(),
-                error=error
-            )
-            session.add(log)
-            logs.append(log)
-            continue
-
-        # Apollo API request
-        data = {
-            "to": to_email,
-            "subject": subject,
-            "body": body
-        }
-
-        headers = {
-            "Authorization": f"Bearer {APOLLO_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                resp = requests.post(
-                    "https://api.apollo.io/v1/email/send",
-                    json=data,
-                    headers=headers,
-                    timeout=10
-                )
-                if resp.status_code == 429:
-                    logging.warning(f"Apollo rate limit hit for user {user.id}, lead {lead.id}. Attempt {attempt+1}/{max_retries}.")
-                    status = "failed"
-                    error = "Apollo rate limit exceeded"
-                    failed_count += 1
-                    break
-                status = "sent" if resp.status_code in [200, 201] else "failed"
-                error = None if status == "sent" else resp.text
-                if status == "sent" or attempt == max_retries - 1:
-                    break
-            except Exception as e:
-                status = "failed"
-                error = str(e)
-                if attempt == max_retries - 1:
-                    failed_count += 1
-
-        log = EmailLog(
-            campaign_id=campaign.id,
-            lead_id=lead.id,
-            to_email=to_email,
-            status=status,
-            sent_at=datetime.utcnow(),
-            error=error
+    query = (
+        select(
+            EmailLog.id, EmailLog.lead_id, Lead.first_name, Lead.last_name, EmailLog.to_email,
+            EmailLog.status, EmailLog.sent_at, EmailLog.opened_at, EmailLog.error
         )
-        session.add(log)
-        logs.append(log)
-
-    await session.commit()
+        .outerjoin(Lead, Lead.id == EmailLog.lead_id)
+        .where(EmailLog.campaign_id == campaign_id)
+        .order_by(EmailLog.sent_at.desc(), EmailLog.id.desc())
+        .limit(page_size + 1)
+    )
+    if status:
+        query = query.where(EmailLog.status.in_([s.strip() for s in status.split(",") if s.strip()]))
+    if cursor:
+        try:
+            sent_at, log_id = cursor.rsplit("|", 1)
+            sent_at, log_id = datetime.fromisoformat(sent_at), int(log_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(or_(
+            EmailLog.sent_at < sent_at,
+            and_(EmailLog.sent_at == sent_at, EmailLog.id < log_id)
+        ))
+    rows = (await session.execute(query)).all()
 
-    # Notify user if any emails failed
-    if failed_count > 0:
-        from models import Notification
-        notification = Notification(
-            user_id=user.id,
-            type="email_failed",
-            message=f"{failed_count} emails failed to send in campaign '{campaign.name}'.",
-            created_at=datetime.utcnow()
-        )
-        session.add(notification)
-        await session.commit()
+    summary_result = await session.execute(
+        select(EmailLog.status, func.count())
+        .where(EmailLog.campaign_id == campaign_id)
+        .group_by(EmailLog.status)
+    )
+    by_status = dict(summary_result.all())
 
+    page = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size and page[-1].sent_at is not None:
+        next_cursor = f"{page[-1].sent_at.isoformat()}|{page[-1].id}"
     return {
-        "message": f"Sent {len(logs)} emails",
-        "results": [{"lead_id": l.lead_id, "status": l.status, "error": l.error} for l in logs]
+        "logs": [
+            {
+                "id": row.id,
+                "lead_id": row.lead_id,
+                "lead_name": f"{row.first_name} {row.last_name}" if row.first_name is not None else None,
+                "to_email": row.to_email,
+                "status": row.status,
+                "sent_at": row.sent_at,
+                "opened_at": row.opened_at,
+                "error": row.error
+            }
+            for row in page
+        ],
+        "next_cursor": next_cursor,
+        "summary": {"total": sum(by_status.values()), "by_status": by_status}
     }
-@router.get("/email-campaigns/{campaign_id}/logs")
-async def get_email_campaign_logs(campaign_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
-    result = await session.execute(select(EmailCampaign).where(EmailCampaign.id == campaign_id, EmailCampaign.user_id == user.id))
-    campaign = result.scalar_one_or_none()
-    if not campaign:
-        raise HTTPException(status_code=404, detail="Email campaign not found")
-    logs_result = await session.execute(select(EmailLog).where(EmailLog.campaign_id == campaign_id))
-    logs = logs_result.scalars().all()
-    # Fetch lead info for each log
-    lead_ids = [log.lead_id for log in logs]
-    leads_result = await session.execute(select(Lead).where(Lead.id.in_(lead_ids)))
-    leads = {lead.id: lead for lead in leads_result.scalars().all()}
-    return [
-        {
-            "lead_id": log.lead_id,
-            "lead_name": f"{leads[log.lead_id].first_name} {leads[log.lead_id].last_name}" if log.lead_id in leads else None,
-            "to_email": log.to_email,
-            "status": log.status,
-            "sent_at": log.sent_at,
-            "opened_at": log.opened_at,
-            "error": log.error
-        }
-        for log in logs
-    ]
 
 
 # PUT endpoint for editing drafted email campaigns
@@ -249,6 +350,15 @@ async def update_email_campaign(
     campaign = result.scalar_one_or_none()
     if not campaign:
         raise HTTPException(status_code=404, detail="Email campaign not found")
+    checked = {}
+    if "subject" in req or "body" in req:
+        try:
+            checked = validate_templates(
+                subject=req.get("subject", campaign.subject),
+                body=req.get("body", campaign.body)
+            )
+        except TemplateError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     # Allow status change and field updates
     if "name" in req:
         campaign.name = req["name"]
@@ -273,7 +383,7 @@ async def update_email_campaign(
     session.add(campaign)
     await session.commit()
     await session.refresh(campaign)
-    return {"id": campaign.id, "message": "Email campaign updated", "status": campaign.status}
+    return {"id": campaign.id, "message": "Email campaign updated", "status": campaign.status, **checked}
 
 # DELETE endpoint for deleting drafted email campaigns
 @router.delete("/email-campaigns/{campaign_id}")
@@ -3,7 +3,7 @@ from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
 from database import get_session
-from auth_utils import create_access_token
+from auth_utils import create_access_token, invalidate_principal
 import os
 import logging
 from authlib.integrations.starlette_client import OAuth
@@ -94,6 +94,7 @@ async def google_callback(
 
         await session.commit()
         await session.refresh(user)
+        invalidate_principal(user.email)
 
         # Create JWT
         access_token = create_access_token({"sub": str(user.id), "email": user.email})
@@ -1,19 +1,24 @@
 
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Request, Query
 from sqlmodel import select
+from sqlalchemy import tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Lead, User, Campaign
-from database import get_session
+from models import Lead, User, Campaign, Notification, EnrichmentBatch
+from database import get_session, get_read_session, async_read_session
 from auth_utils import get_current_user
 from schemas import LeadOut, LeadListResponse
-from typing import List
+from lead_import import REQUIRED_COLUMNS, open_csv_text, import_lead_rows
+from usage import get_usage, record_usage, is_messaged
+from enrichment import enrichment_cache, lookup_email, EnrichmentError
+from jobs import enqueue
+from events import pubsub, user_topic
+import lead_search
+from typing import List, Optional
 import csv
+import json
+import zlib
 from io import StringIO
-from collections import defaultdict
 import os
-import requests
-import time
-import logging
 from fastapi.responses import StreamingResponse
 from datetime import datetime
 
@@ -23,19 +28,31 @@ router = APIRouter(prefix="/leads", tags=["leads"])
 from routers.subscriptions import SUBSCRIPTION_PLANS
 
 
-# Enhanced upload: deduplication, validation, Hunter.io enrichment
+# Enhanced upload: validation, chunked bulk inserts, database-side deduplication.
+# Accepts either a multipart form (`file` + `campaignId`), which is parsed
+# incrementally from the spooled upload, or the legacy JSON body with `csvData`.
 @router.post("/upload")
-async def upload_leads(req: dict, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+async def upload_leads(request: Request, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        async with request.form() as form:
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="No CSV file provided")
+            return await _import_leads(session, user, int(form.get("campaignId", "1")), open_csv_text(upload.file))
+    req = await request.json()
+    csv_data = req.get("csvData", "")
+    return await _import_leads(session, user, int(req.get("campaignId", "1")), StringIO(csv_data) if csv_data else None)
+
+
+async def _import_leads(session: AsyncSession, user: User, campaign_id: int, csv_file):
     plan = SUBSCRIPTION_PLANS.get(user.subscription_tier, SUBSCRIPTION_PLANS["free"])
     limit = plan["leads_limit"]
-    campaign_id = int(req.get("campaignId", "1"))
     campaign_result = await session.execute(select(Campaign).where(Campaign.id == campaign_id, Campaign.user_id == user.id))
     campaign = campaign_result.scalar_one_or_none()
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
-    leads_result = await session.execute(select(Lead).join(Campaign).where(Campaign.user_id == user.id))
-    existing_leads = leads_result.scalars().all()
-    leads_count = len(existing_leads)
+    usage = await get_usage(session, user.id)
+    leads_count = usage["leads_owned"]
     warning_threshold = limit * 0.8
     is_near_limit = leads_count >= warning_threshold
     is_over_limit = leads_count >= limit
@@ -48,13 +65,10 @@ async def upload_leads(req: dict, session: AsyncSession = Depends(get_session),
             "limit": limit,
             "upgrade_required": True
         }
-    csv_data = req.get("csvData", "")
-    if not csv_data:
+    if csv_file is None:
         raise HTTPException(status_code=400, detail="No CSV data provided")
-    leads_created = 0
-    reader = csv.DictReader(StringIO(csv_data))
-    required_columns = {"first_name", "last_name", "company", "profile_url", "job_title"}
-    missing_columns = required_columns - set(reader.fieldnames or [])
+    reader = csv.DictReader(csv_file)
+    missing_columns = REQUIRED_COLUMNS - set(reader.fieldnames or [])
     if missing_columns:
         return {
             "message": f"CSV missing required columns: {', '.join(missing_columns)}",
@@ -63,43 +77,32 @@ async def upload_leads(req: dict, session: AsyncSession = Depends(get_session),
             "limit": limit,
             "warning": "csv_invalid"
         }
-    deduped = set((l.first_name, l.last_name, l.company, l.profile_url) for l in existing_leads)
-    for row in reader:
-        key = (row.get("first_name", ""), row.get("last_name", ""), row.get("company", ""), row.get("profile_url", ""))
-        if key in deduped:
-            continue  # skip duplicate
-        if leads_created + leads_count >= limit:
-            break
-        lead = Lead(
-            first_name=row.get("first_name", ""),
-            last_name=row.get("last_name", ""),
-            job_title=row.get("job_title", ""),
-            company=row.get("company", ""),
-            profile_url=row.get("profile_url", ""),
-            status="pending",
-            campaign_id=campaign_id
-        )
-        session.add(lead)
-        leads_created += 1
-        deduped.add(key)
+    stats = await import_lead_rows(session, reader, campaign_id, limit - leads_count)
+    await record_usage(session, user.id, leads=stats["leads_created"])
     await session.commit()
+    leads_created = stats["leads_created"]
     response = {
         "message": f"Successfully uploaded {leads_created} leads",
         "leads_created": leads_created,
         "current_usage": leads_count + leads_created,
-        "limit": limit
+        "limit": limit,
+        "rows_processed": stats["rows_processed"],
+        "duplicates": stats["duplicates"],
+        "rows_rejected": stats["rows_rejected"],
+        "rejected": stats["rejected"],
+        "elapsed_seconds": stats["elapsed_seconds"],
+        "rows_per_second": stats["rows_per_second"]
     }
-    if is_near_limit and not is_over_limit:
+    if stats["limit_reached"]:
+        response["warning"] = "limit_reached"
+        response["upgrade_required"] = True
+        response["message"] += f". Import stopped at your {user.subscription_tier} plan limit of {limit} leads."
+    elif is_near_limit and not is_over_limit:
         response["warning"] = "approaching_limit"
         response["message"] += f". You're approaching your {user.subscription_tier} plan limit ({leads_count + leads_created}/{limit} leads)."
     return response
 
-# Hunter.io enrichment endpoint
-enrichment_cache = defaultdict(dict)  # { (first_name, last_name, company): {"email":..., "confidence":...} }
-
-# Simple in-memory cache
-enrichment_cache = {}
-
+# Apollo.io enrichment endpoint
 @router.post("/enrich-email")
 async def enrich_lead_email(
     req: dict,
@@ -122,86 +125,165 @@ async def enrich_lead_email(
     if getattr(lead, "email", None):
         return {"message": "Lead already has email", "email": lead.email}
 
-    # Check cache
-    cache_key = (lead.first_name, lead.last_name, lead.company)
-    if cache_key in enrichment_cache:
-        cached = enrichment_cache[cache_key]
-        if cached.get("email"):
-            lead.email = cached["email"]
-            lead.email_confidence = cached.get("confidence", 0)
-            session.add(lead)
-            await session.commit()
-            return {"email": lead.email, "confidence": lead.email_confidence, "cached": True}
-
-    # Use Apollo.io API
-    APOLLO_API_KEY = user.apollo_api_key
+    # Use Apollo.io API, behind the shared enrichment cache
+    APOLLO_API_KEY = user.appollo_api_key
+    if not APOLLO_API_KEY:
+        raise HTTPException(status_code=500, detail="Apollo API key not configured for this user")
+
+    try:
+        found, cached = await lookup_email(APOLLO_API_KEY, lead.first_name, lead.last_name, lead.company)
+    except EnrichmentError as e:
+        notification = Notification(
+            user_id=user.id,
+            type="enrichment_failed",
+            message=f"Apollo.io error for lead {lead.first_name} {lead.last_name}: {str(e)}",
+            created_at=datetime.utcnow()
+        )
+        session.add(notification)
+        await session.commit()
+        pubsub.publish(user_topic(user.id, "notifications"))
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if not found["email"]:
+        return {"message": "No email found via Apollo.io.", "cached": cached}
+    lead.email = found["email"]
+    lead.email_confidence = found["confidence"]
+    session.add(lead)
+    await session.commit()
+    return {"email": lead.email, "confidence": lead.email_confidence, "cached": cached}
+
+
+@router.get("/enrichment-cache/stats")
+async def enrichment_cache_stats(user: User = Depends(get_current_user)):
+    """Hit/miss/eviction counters for this worker's enrichment cache"""
+    return enrichment_cache.stats()
+
+
+@router.post("/enrich-batch")
+async def enrich_leads_batch(
+    req: dict = Body(...),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(get_current_user)
+):
+    """Queue enrichment of every lead without an email in a campaign (`campaignId`) or a list (`leadIds`)."""
+    lead_ids = req.get("leadIds")
+    campaign_id = req.get("campaignId")
+    if not lead_ids and not campaign_id:
+        raise HTTPException(status_code=400, detail="leadIds or campaignId required")
+    APOLLO_API_KEY = user.appollo_api_key
     if not APOLLO_API_KEY:
         raise HTTPException(status_code=500, detail="Apollo API key not configured for this user")
+    query = (
+        select(Lead.id)
+        .join(Campaign)
+        .where(Campaign.user_id == user.id, (Lead.email == None) | (Lead.email == ""))
+        .order_by(Lead.id)
+    )
+    if lead_ids:
+        query = query.where(Lead.id.in_(lead_ids))
+    if campaign_id:
+        query = query.where(Lead.campaign_id == int(campaign_id))
+    result = await session.execute(query)
+    lead_ids = result.scalars().all()
+    batch = EnrichmentBatch(user_id=user.id, total=len(lead_ids))
+    session.add(batch)
+    await session.flush()
+    await enqueue(session, "enrich_batch", {"batch_id": batch.id, "lead_ids": lead_ids})
+    await session.commit()
+    await session.refresh(batch)
+    return {"batch_id": batch.id, "total": batch.total, "status": batch.status}
 
-    url = "https://api.apollo.io/v1/people/match"  # Apollo enrichment endpoint
-    headers = {"Authorization": f"Bearer {APOLLO_API_KEY}", "Content-Type": "application/json"}
-    payload = {
-        "first_name": lead.first_name,
-        "last_name": lead.last_name,
-        "company": lead.company
+
+@router.get("/enrich-batch/{batch_id}")
+async def get_enrichment_batch(batch_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    result = await session.execute(
+        select(EnrichmentBatch).where(EnrichmentBatch.id == batch_id, EnrichmentBatch.user_id == user.id)
+    )
+    batch = result.scalar_one_or_none()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Enrichment batch not found")
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": batch.total,
+        "processed": batch.processed,
+        "enriched": batch.enriched,
+        "not_found": batch.not_found,
+        "failed": batch.failed,
+        "created_at": batch.created_at,
+        "finished_at": batch.finished_at
     }
 
-    max_retries = 3
-    backoff = 2
-    for attempt in range(max_retries):
-        try:
-            resp = requests.post(url, json=payload, headers=headers, timeout=10)
-            if resp.status_code == 429:
-                logging.warning(f"Apollo rate limit hit for user {user.id}. Attempt {attempt+1}/{max_retries}.")
-                if attempt < max_retries - 1:
-                    time.sleep(backoff ** attempt)
-                    continue
-                else:
-                    notification = Notification(
-                        user_id=user.id,
-                        type="enrichment_failed",
-                        message=f"Apollo rate limit exceeded for lead {lead.first_name} {lead.last_name}.",
-                        created_at=datetime.utcnow()
-                    )
-                    session.add(notification)
-                    await session.commit()
-                    raise HTTPException(status_code=429, detail="Apollo rate limit exceeded. Try later.")
-            data = resp.json()
-            if "person" in data and "email" in data["person"]:
-                lead.email = data["person"]["email"]
-                lead.email_confidence = data["person"].get("confidence", 0)
-                session.add(lead)
-                await session.commit()
-                enrichment_cache[cache_key] = {"email": lead.email, "confidence": lead.email_confidence}
-                return {"email": lead.email, "confidence": lead.email_confidence}
-            else:
-                enrichment_cache[cache_key] = {"email": None, "confidence": None}
-                return {"message": "No email found via Apollo.io."}
-        except Exception as e:
-            logging.error(f"Apollo.io error for user {user.id}: {str(e)}")
-            if attempt == max_retries - 1:
-                notification = Notification(
-                    user_id=user.id,
-                    type="enrichment_failed",
-                    message=f"Apollo.io error for lead {lead.first_name} {lead.last_name}: {str(e)}",
-                    created_at=datetime.utcnow()
-                )
-                session.add(notification)
-                await session.commit()
-                raise HTTPException(status_code=500, detail=f"Apollo.io error: {str(e)}")
-            time.sleep(backoff ** attempt)
-
-
-@router.get("/list", response_model=LeadListResponse)
-async def list_leads(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user), unassigned: bool = False):
-    plan = SUBSCRIPTION_PLANS.get(user.subscription_tier, SUBSCRIPTION_PLANS["free"])
-    limit = plan["leads_limit"]
-    query = select(Lead).join(Campaign, isouter=True).where(Campaign.user_id == user.id)
+
+LIST_FIELDS = {
+    "id": Lead.id,
+    "first_name": Lead.first_name,
+    "last_name": Lead.last_name,
+    "job_title": Lead.job_title,
+    "company": Lead.company,
+    "profile_url": Lead.profile_url,
+    "status": Lead.status,
+    "message_text": Lead.message_text,
+    "email": Lead.email,
+    "email_confidence": Lead.email_confidence,
+    "campaign_id": Lead.campaign_id,
+}
+MAX_PAGE_SIZE = 500
+
+
+@router.get("/list", response_model=LeadListResponse, response_model_exclude_unset=True)
+async def list_leads(
+    session: AsyncSession = Depends(get_read_session),
+    user: User = Depends(get_current_user),
+    unassigned: bool = False,
+    cursor: Optional[int] = None,
+    page_size: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    status: Optional[str] = None,
+    campaign_id: Optional[int] = None,
+    has_email: Optional[bool] = None,
+    min_confidence: Optional[int] = None,
+    max_confidence: Optional[int] = None,
+    fields: Optional[str] = None
+):
+    """
+    Keyset-paginated lead list. Pass the returned `next_cursor` as `cursor` to
+    fetch the next page; `status` accepts a comma-separated list and `fields`
+    limits the selected columns (id is always included).
+    """
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = set(names) - set(LIST_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        names = ["id"] + [name for name in names if name != "id"]
+    else:
+        names = list(LIST_FIELDS)
+    query = (
+        select(*[LIST_FIELDS[name] for name in names])
+        .join(Campaign, isouter=True)
+        .where(Campaign.user_id == user.id)
+    )
     if unassigned:
         query = query.where(Lead.campaign_id == None)
-    result = await session.execute(query.limit(limit))
-    leads = result.scalars().all()
-    return {"leads": leads}
+    if cursor is not None:
+        query = query.where(Lead.id > cursor)
+    if status:
+        query = query.where(Lead.status.in_([value.strip() for value in status.split(",")]))
+    if campaign_id is not None:
+        query = query.where(Lead.campaign_id == campaign_id)
+    if has_email is True:
+        query = query.where(Lead.email != None, Lead.email != "")
+    elif has_email is False:
+        query = query.where((Lead.email == None) | (Lead.email == ""))
+    if min_confidence is not None:
+        query = query.where(Lead.email_confidence >= min_confidence)
+    if max_confidence is not None:
+        query = query.where(Lead.email_confidence <= max_confidence)
+    # Fetch one extra row to learn whether another page exists
+    result = await session.execute(query.order_by(Lead.id).limit(page_size + 1))
+    rows = result.mappings().all()
+    leads = [dict(row) for row in rows[:page_size]]
+    next_cursor = leads[-1]["id"] if len(rows) > page_size else None
+    return {"leads": leads, "next_cursor": next_cursor}
 
 @router.put("/{lead_id}")
 async def update_lead(lead_id: int, req: dict, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
@@ -218,6 +300,7 @@ async def update_lead(lead_id: int, req: dict, session: AsyncSession = Depends(g
     if "status" in req:
         lead.status = req["status"]
     session.add(lead)
+    await record_usage(session, user.id, messages=int(is_messaged(lead.status)) - int(is_messaged(status_before)))
     await session.commit()
     # Notification trigger for lead update
     if status_before != lead.status:
@@ -230,6 +313,7 @@ async def update_lead(lead_id: int, req: dict, session: AsyncSession = Depends(g
         )
         session.add(notification)
         await session.commit()
+        pubsub.publish(user_topic(user.id, "notifications"))
     return {"message": "Lead updated"}
 
 @router.delete("/{lead_id}")
@@ -245,16 +329,10 @@ async def delete_lead(lead_id: int, session: AsyncSession = Depends(get_session)
         raise HTTPException(status_code=404, detail="Lead not found")
     
     await session.delete(lead)
+    await record_usage(session, user.id, leads=-1, messages=-int(is_messaged(lead.status)))
     await session.commit()
     return {"message": "Lead deleted"}
 
-import asyncio
-import httpx
-from models import User, Notification
-from database import get_session
-
-
-router = APIRouter()
 
 @router.post("/scrape-linkedin-leads")
 async def scrape_linkedin_leads(
@@ -262,65 +340,79 @@ async def scrape_linkedin_leads(
     user: User = Depends(get_current_user)
 ):
     # 1. Pick API key from user record or fallback env
-    apollo_key = "OK32YqkeuWZ2XII25SG_7A"
+    apollo_key = lead_search.APOLLO_SEARCH_API_KEY
     if not apollo_key:
         raise HTTPException(status_code=400, detail="Apollo API key not configured.")
 
-    url = "https://api.apollo.io/api/v1/mixed_people/search"
-    headers = {
-    "accept": "application/json",
-    "Cache-Control": "no-cache",
-    "Content-Type": "application/json",
-    "x-api-key": apollo_key
-}
+    # 2. Build payload, then serve it from the search cache or Apollo
+    try:
+        payload = lead_search.build_payload(req)
+        data, cached = await lead_search.search(apollo_key, payload)
+    except lead_search.SearchError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {
+        "message": "Apollo lead scrape triggered",
+        "apollo_response": data,
+        "cached": cached
+    }
 
 
-    # 2. Build payload
-    payload = {
-        "page": req.get("page", 1),
-        "per_page": req.get("per_page", 20),
-    }
-    if req.get("currentCompany"):
-        payload["q_organization_keywords"] = req["currentCompany"]
-    if req.get("job_title"):
-        payload["person_titles"] = req["job_title"]
-    if req.get("location"):
-        payload["person_locations"] = req["location"]
-    if req.get("keywords"):
-        payload["q_keywords"] = req["keywords"]
-    if req.get("industry"):
-        payload["industry_tag_ids"] = req["industry"]
-
-    max_retries = 3
-    backoff = 2
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for attempt in range(max_retries):
-            try:
-                response = await client.post(url, headers=headers, json=payload)
-
-                if response.status_code == 429:
-                    logging.warning(f"Apollo rate limit, attempt {attempt + 1}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(backoff ** attempt)
-                        continue
-                    raise HTTPException(status_code=429, detail="Apollo rate limit exceeded.")
-
-                if response.status_code == 422:
-                    err = response.json().get("message") or response.text
-                    raise HTTPException(status_code=422, detail=f"Apollo error: {err}")
-
-                response.raise_for_status()
-                return {
-                    "message": "Apollo lead scrape triggered",
-                    "apollo_response": response.json()
-                }
-
-            except httpx.RequestError as e:
-                logging.error(f"Apollo request error: {e}")
-                if attempt == max_retries - 1:
-                    raise HTTPException(status_code=500, detail=f"Apollo request error: {e}")
-                await asyncio.sleep(backoff ** attempt)
+@router.get("/search-cache/stats")
+async def search_cache_stats(user: User = Depends(get_current_user)):
+    """Hit/miss and prefetch counters for this worker's Apollo search cache"""
+    return lead_search.stats()
+
+
+async def _harvest_lines(apollo_key: str, payload: dict, pages: int, campaign_id: int, user_id: int, max_new: int):
+    async for event in lead_search.harvest(apollo_key, payload, pages, campaign_id, user_id, max_new):
+        yield json.dumps(event) + "\n"
+
+
+@router.post("/harvest")
+async def harvest_leads(
+    req: dict = Body(...),
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(get_current_user)
+):
+    """
+    Walk `pages` pages of an Apollo search (same filters as
+    /scrape-linkedin-leads) and add the people to a campaign as leads.
+    Streams NDJSON progress: a "started" line, one "page" line per stored
+    page, then "done", or "error" if Apollo fails part way.
+    """
+    apollo_key = lead_search.APOLLO_SEARCH_API_KEY
+    if not apollo_key:
+        raise HTTPException(status_code=400, detail="Apollo API key not configured.")
+    try:
+        campaign_id = int(req.get("campaignId"))
+        pages = int(req.get("pages", 1))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="campaignId and pages must be numbers")
+    if not 1 <= pages <= lead_search.MAX_HARVEST_PAGES:
+        raise HTTPException(status_code=400, detail=f"pages must be between 1 and {lead_search.MAX_HARVEST_PAGES}")
+    try:
+        payload = lead_search.build_payload({"per_page": lead_search.MAX_PER_PAGE, **req})
+    except lead_search.SearchError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    campaign_result = await session.execute(select(Campaign).where(Campaign.id == campaign_id, Campaign.user_id == user.id))
+    if not campaign_result.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    plan = SUBSCRIPTION_PLANS.get(user.subscription_tier, SUBSCRIPTION_PLANS["free"])
+    usage = await get_usage(session, user.id)
+    remaining = plan["leads_limit"] - usage["leads_owned"]
+    if remaining <= 0:
+        raise HTTPException(
+            status_code=403,
+            detail=f"You've reached your {user.subscription_tier} plan limit of {plan['leads_limit']} leads. Consider upgrading for more capacity."
+        )
+    return StreamingResponse(
+        _harvest_lines(apollo_key, payload, pages, campaign_id, user.id, remaining),
+        media_type="application/x-ndjson"
+    )
+
+
+def _lead_identity(lead: Lead) -> tuple:
+    return (lead.first_name, lead.last_name, lead.company, lead.profile_url)
 
 
 @router.post("/assign-to-campaign")
@@ -336,10 +428,27 @@ async def assign_leads_to_campaign(req: dict = Body(...), session: AsyncSession
         raise HTTPException(status_code=404, detail="Campaign not found")
     # Assign leads
     leads_result = await session.execute(select(Lead).where(Lead.id.in_(lead_ids), Lead.campaign_id == None))
-    leads = leads_result.scalars().all()
-    for lead in leads:
+    candidates = leads_result.scalars().all()
+    # Leads the campaign already has would violate uq_lead_campaign_identity; skip them
+    taken = set()
+    if candidates:
+        existing_result = await session.execute(
+            select(Lead.first_name, Lead.last_name, Lead.company, Lead.profile_url).where(
+                Lead.campaign_id == campaign_id,
+                tuple_(Lead.first_name, Lead.last_name, Lead.company, Lead.profile_url).in_([_lead_identity(lead) for lead in candidates]),
+            )
+        )
+        taken = {tuple(row) for row in existing_result.all()}
+    leads = []
+    for lead in candidates:
+        if _lead_identity(lead) in taken:
+            continue
+        taken.add(_lead_identity(lead))
         lead.campaign_id = campaign_id
         session.add(lead)
+        leads.append(lead)
+    duplicates = len(candidates) - len(leads)
+    await record_usage(session, user.id, leads=len(leads), messages=sum(1 for lead in leads if is_messaged(lead.status)))
     await session.commit()
     # Notification trigger for lead assignment
     if leads:
@@ -352,29 +461,80 @@ async def assign_leads_to_campaign(req: dict = Body(...), session: AsyncSession
         )
         session.add(notification)
         await session.commit()
-    return {"message": f"Assigned {len(leads)} leads to campaign"}
+        pubsub.publish(user_topic(user.id, "notifications"))
+    message = f"Assigned {len(leads)} leads to campaign"
+    if duplicates:
+        message += f"; skipped {duplicates} already in it"
+    return {"message": message, "assigned": len(leads), "duplicates": duplicates}
+
+# (CSV header, NDJSON key, column) for every exported field
+EXPORT_COLUMNS = [
+    ("First Name", "first_name", Lead.first_name),
+    ("Last Name", "last_name", Lead.last_name),
+    ("Job Title", "job_title", Lead.job_title),
+    ("Company", "company", Lead.company),
+    ("Profile URL", "profile_url", Lead.profile_url),
+    ("Status", "status", Lead.status),
+    ("Email", "email", Lead.email),
+    ("Email Confidence", "email_confidence", Lead.email_confidence),
+]
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "leads.csv"),
+    "csv.gz": ("application/gzip", "leads.csv.gz"),
+    "ndjson": ("application/x-ndjson", "leads.ndjson"),
+}
+EXPORT_BATCH_SIZE = int(os.getenv("LEAD_EXPORT_BATCH_SIZE", "1000"))
+
+
+def _csv_chunk(rows) -> str:
+    output = StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
+
+
+async def _export_chunks(query, export_format: str):
+    """Yield encoded export chunks, one per batch fetched from a server-side cursor."""
+    compressor = zlib.compressobj(wbits=31) if export_format == "csv.gz" else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    if export_format != "ndjson":
+        # Send the header before touching the database so the first byte goes out immediately
+        yield encode(_csv_chunk([[header for header, _, _ in EXPORT_COLUMNS]]))
+    # The request-scoped session is closed once the handler returns, so the
+    # generator holds its own session for as long as the response streams.
+    async with async_read_session() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            if export_format == "ndjson":
+                keys = [key for _, key, _ in EXPORT_COLUMNS]
+                text = "".join(json.dumps(dict(zip(keys, row))) + "\n" for row in rows)
+            else:
+                text = _csv_chunk([["" if value is None else value for value in row] for row in rows])
+            chunk = encode(text)
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
+
 
 @router.get("/export")
-async def export_leads(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user), unassigned: bool = False):
-    query = select(Lead).join(Campaign, isouter=True).where(Campaign.user_id == user.id)
+async def export_leads(user: User = Depends(get_current_user), unassigned: bool = False, format: str = "csv"):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format. Use one of: {', '.join(EXPORT_FORMATS)}")
+    query = (
+        select(*[column for _, _, column in EXPORT_COLUMNS])
+        .join(Campaign, isouter=True)
+        .where(Campaign.user_id == user.id)
+        .order_by(Lead.id)
+    )
     if unassigned:
         query = query.where(Lead.campaign_id == None)
-    result = await session.execute(query)
-    leads = result.scalars().all()
-    # Prepare CSV
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["First Name", "Last Name", "Job Title", "Company", "Profile URL", "Status", "Email", "Email Confidence"])
-    for lead in leads:
-        writer.writerow([
-            lead.first_name,
-            lead.last_name,
-            lead.job_title,
-            lead.company,
-            lead.profile_url,
-            lead.status,
-            getattr(lead, "email", ""),
-            getattr(lead, "email_confidence", "")
-        ])
-    output.seek(0)
-    return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=leads.csv"})
+    media_type, filename = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        _export_chunks(query, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
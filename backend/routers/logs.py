@@ -1,14 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from models import OutreachLog, Lead, User, Campaign
 from database import get_session
 from auth_utils import get_current_user
-from schemas import OutreachLogCreate
+from schemas import OutreachLogCreate, OutreachLogBatch, OutreachLogBatchItem
+from scheduler import start_follow_up_messages
+from usage import is_messaged
+from rollups import LINKEDIN, record_events
+from events import pubsub, user_topic
 from datetime import datetime
 
 router = APIRouter(prefix="/api/logs", tags=["logs"])
 
+MAX_OUTREACH_BATCH = 5000
+
 @router.post("/outreach")
 async def log_outreach(log: OutreachLogCreate, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
     # Verify the lead belongs to the user
@@ -23,10 +31,84 @@ async def log_outreach(log: OutreachLogCreate, session: AsyncSession = Depends(g
     
     outreach_log = OutreachLog(
         lead_id=log.lead_id,
+        user_id=user.id,
         status=log.status,
         message=log.message,
         timestamp=datetime.utcnow()
     )
     session.add(outreach_log)
+    await record_events(session, user.id, LINKEDIN, [(lead.campaign_id, outreach_log.timestamp, log.status)])
+    # The first message sent in a campaign starts its follow-up sequence
+    if is_messaged(log.status) and log.status != "replied":
+        await start_follow_up_messages(session, lead.campaign_id, outreach_log.timestamp)
     await session.commit()
+    pubsub.publish(user_topic(user.id, "activity"))
     return {"message": "Outreach logged successfully"}
+
+
+def _utc_naive(value: datetime, now: datetime) -> datetime:
+    if value.tzinfo:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    # Client clocks drift; never record an action in the future
+    return min(value, now)
+
+
+@router.post("/outreach/batch")
+async def log_outreach_batch(batch: OutreachLogBatch, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    """
+    Log many outreach actions at once. Ownership of every lead is checked
+    with one query and accepted entries are written with one multi-row
+    insert. Returns a per-entry result in request order.
+    """
+    if len(batch.entries) > MAX_OUTREACH_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_OUTREACH_BATCH} entries per batch")
+    now = datetime.utcnow()
+    results = [None] * len(batch.entries)
+    valid = []
+    for index, entry in enumerate(batch.entries):
+        try:
+            item = OutreachLogBatchItem.model_validate(entry)
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"]) or "entry"
+            results[index] = {"index": index, "status": "rejected", "error": f"{field}: {error['msg']}"}
+            continue
+        valid.append((index, item))
+
+    lead_campaigns = {}
+    lead_ids = {item.lead_id for _, item in valid}
+    if lead_ids:
+        result = await session.execute(
+            select(Lead.id, Lead.campaign_id)
+            .join(Campaign)
+            .where(Lead.id.in_(lead_ids), Campaign.user_id == user.id)
+        )
+        lead_campaigns = dict(result.all())
+
+    accepted, rows = [], []
+    for index, item in valid:
+        if item.lead_id not in lead_campaigns:
+            results[index] = {"index": index, "status": "rejected", "error": "Lead not found"}
+            continue
+        timestamp = _utc_naive(item.timestamp, now) if item.timestamp else now
+        accepted.append(index)
+        rows.append({"lead_id": item.lead_id, "user_id": user.id, "status": item.status, "message": item.message, "timestamp": timestamp})
+
+    if rows:
+        # Rendered as multi-row INSERT ... RETURNING, with ids in row order
+        result = await session.execute(insert(OutreachLog).returning(OutreachLog.id, sort_by_parameter_order=True), rows)
+        for index, log_id in zip(accepted, result.scalars().all()):
+            results[index] = {"index": index, "status": "accepted", "id": log_id}
+        await record_events(session, user.id, LINKEDIN, ((lead_campaigns[r["lead_id"]], r["timestamp"], r["status"]) for r in rows))
+        # The first message sent in a campaign starts its follow-up sequence
+        first_sent = {}
+        for r in rows:
+            if is_messaged(r["status"]) and r["status"] != "replied":
+                campaign_id = lead_campaigns[r["lead_id"]]
+                first_sent[campaign_id] = min(r["timestamp"], first_sent.get(campaign_id, r["timestamp"]))
+        for campaign_id, timestamp in sorted(first_sent.items()):
+            await start_follow_up_messages(session, campaign_id, timestamp)
+        await session.commit()
+        pubsub.publish(user_topic(user.id, "activity"))
+
+    return {"accepted": len(rows), "rejected": len(results) - len(rows), "results": results}
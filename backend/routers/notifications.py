@@ -1,37 +1,170 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-from ..models import Notification, User
-from ..database import get_session
-from typing import List
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Notification, User
+from database import get_session, get_read_session, async_session
+from auth_utils import get_current_user
+from schemas import NotificationCreate, NotificationOut, NotificationListResponse, NotificationMarkRead
+from events import pubsub, user_topic, sse_event, SSE_HEADERS, SSE_KEEPALIVE
+from datetime import datetime
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
-@router.get("/", response_model=List[Notification])
-def get_notifications(user_id: int, session: Session = Depends(get_session)):
-    return session.exec(select(Notification).where(Notification.user_id == user_id)).all()
+MAX_NOTIFICATION_PAGE_SIZE = 200
+# Idle streams send a keepalive and re-check the table this often, which
+# also picks up notifications created by job workers
+NOTIFICATION_STREAM_POLL_SECONDS = 15
+
+
+def _notification_out(notification: Notification) -> dict:
+    return NotificationOut.model_validate(notification, from_attributes=True).model_dump(mode="json")
+
+
+async def unread_count(session: AsyncSession, user_id: int) -> int:
+    # Answered from ix_notification_user_id_read_created_at alone
+    result = await session.execute(
+        select(func.count()).select_from(Notification).where(Notification.user_id == user_id, Notification.read == False)
+    )
+    return result.scalar_one()
+
+
+async def _fetch_notifications(session: AsyncSession, user_id: int, limit: int, before: Optional[int] = None,
+                               after: Optional[int] = None, unread_only: bool = False):
+    query = select(Notification).where(Notification.user_id == user_id).limit(limit)
+    if unread_only:
+        query = query.where(Notification.read == False)
+    if after is not None:
+        query = query.where(Notification.id > after).order_by(Notification.id)
+    else:
+        query = query.order_by(Notification.id.desc())
+        if before is not None:
+            query = query.where(Notification.id < before)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+@router.get("/", response_model=NotificationListResponse)
+async def get_notifications(
+    before: Optional[int] = Query(None, description="Only return notifications older than this id"),
+    limit: int = Query(50, ge=1, le=MAX_NOTIFICATION_PAGE_SIZE),
+    unread_only: bool = False,
+    session: AsyncSession = Depends(get_read_session),
+    user: User = Depends(get_current_user)
+):
+    """Newest-first notifications. For the next page pass next_cursor as `before`."""
+    notifications = await _fetch_notifications(session, user.id, limit, before=before, unread_only=unread_only)
+    return {
+        "notifications": [_notification_out(notification) for notification in notifications],
+        "next_cursor": notifications[-1].id if len(notifications) == limit else None,
+        "unread_count": await unread_count(session, user.id),
+    }
+
+
+@router.get("/unread-count")
+async def get_unread_count(session: AsyncSession = Depends(get_read_session), user: User = Depends(get_current_user)):
+    return {"unread_count": await unread_count(session, user.id)}
 
-@router.post("/", response_model=Notification)
-def create_notification(notification: Notification, session: Session = Depends(get_session)):
+
+@router.post("/", response_model=NotificationOut)
+async def create_notification(body: NotificationCreate, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    notification = Notification(user_id=user.id, type=body.type, message=body.message, created_at=datetime.utcnow())
     session.add(notification)
-    session.commit()
-    session.refresh(notification)
+    await session.commit()
+    pubsub.publish(user_topic(user.id, "notifications"))
     return notification
 
+
+@router.post("/mark-read")
+async def mark_notifications_read(body: NotificationMarkRead, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    """Mark several notifications read in one UPDATE: by ids, everything up to an id, or all."""
+    stmt = update(Notification).where(Notification.user_id == user.id, Notification.read == False)
+    if body.ids is not None:
+        stmt = stmt.where(Notification.id.in_(body.ids))
+    if body.up_to is not None:
+        stmt = stmt.where(Notification.id <= body.up_to)
+    result = await session.execute(stmt.values(read=True))
+    await session.commit()
+    if result.rowcount:
+        pubsub.publish(user_topic(user.id, "notifications"))
+    return {"updated": result.rowcount, "unread_count": await unread_count(session, user.id)}
+
+
 @router.post("/mark-read/{notification_id}")
-def mark_notification_read(notification_id: int, session: Session = Depends(get_session)):
-    notification = session.get(Notification, notification_id)
-    if not notification:
+async def mark_notification_read(notification_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    notification = await session.get(Notification, notification_id)
+    if not notification or notification.user_id != user.id:
         raise HTTPException(status_code=404, detail="Notification not found")
-    notification.read = True
-    session.add(notification)
-    session.commit()
+    if not notification.read:
+        notification.read = True
+        session.add(notification)
+        await session.commit()
+        pubsub.publish(user_topic(user.id, "notifications"))
     return {"success": True}
 
+
 @router.delete("/{notification_id}")
-def delete_notification(notification_id: int, session: Session = Depends(get_session)):
-    notification = session.get(Notification, notification_id)
-    if not notification:
+async def delete_notification(notification_id: int, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
+    notification = await session.get(Notification, notification_id)
+    if not notification or notification.user_id != user.id:
         raise HTTPException(status_code=404, detail="Notification not found")
-    session.delete(notification)
-    session.commit()
+    was_unread = not notification.read
+    await session.delete(notification)
+    await session.commit()
+    if was_unread:
+        pubsub.publish(user_topic(user.id, "notifications"))
     return {"success": True}
+
+
+async def _notification_events(request: Request, user_id: int, last_id: Optional[int]):
+    # Reads go to the primary, since a wakeup follows a commit the replica may
+    # not have yet. Subscribe before reading so nothing created in between is missed
+    async with pubsub.subscribe(user_topic(user_id, "notifications")) as wakeups:
+        if last_id is None:
+            async with async_session() as session:
+                result = await session.execute(select(func.max(Notification.id)).where(Notification.user_id == user_id))
+                last_id = result.scalar_one_or_none() or 0
+        last_count = None
+        while not await request.is_disconnected():
+            while True:
+                async with async_session() as session:
+                    notifications = await _fetch_notifications(session, user_id, MAX_NOTIFICATION_PAGE_SIZE, after=last_id)
+                for notification in notifications:
+                    yield sse_event(_notification_out(notification), event="notification", id=notification.id)
+                if notifications:
+                    last_id = notifications[-1].id
+                if len(notifications) < MAX_NOTIFICATION_PAGE_SIZE:
+                    break
+            # Reads and deletes elsewhere change the badge without a new notification
+            async with async_session() as session:
+                count = await unread_count(session, user_id)
+            if count != last_count:
+                yield sse_event({"unread_count": count}, event="unread")
+                last_count = count
+            try:
+                await asyncio.wait_for(wakeups.get(), NOTIFICATION_STREAM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                yield SSE_KEEPALIVE
+            # One read covers every event that arrived meanwhile
+            while not wakeups.empty():
+                wakeups.get_nowait()
+
+
+@router.get("/stream")
+async def stream_notifications(
+    request: Request,
+    after: Optional[int] = Query(None, description="Replay notifications newer than this id first"),
+    last_event_id: Optional[int] = Header(None),
+    user: User = Depends(get_current_user)
+):
+    """
+    Server-Sent Events stream: a "notification" event per new notification
+    and an "unread" event whenever the unread count changes. Reconnecting
+    clients resume from Last-Event-ID.
+    """
+    start = last_event_id if last_event_id is not None else after
+    return StreamingResponse(_notification_events(request, user.id, start), media_type="text/event-stream", headers=SSE_HEADERS)
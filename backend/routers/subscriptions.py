@@ -3,7 +3,9 @@ from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
 from database import get_session
-from auth_utils import get_current_user
+from auth_utils import get_current_user, invalidate_principal
+from ai_ledger import AI_QUOTAS
+from events import pubsub, user_topic
 
 import os
 import stripe
@@ -26,6 +28,7 @@ SUBSCRIPTION_PLANS = {
         "price": 0,
         "currency": "NGN",
         "leads_limit": 10,
+        "ai_messages_limit": AI_QUOTAS["free"],
         "description": "Perfect for getting started"
     },
     "pro": {
@@ -33,6 +36,7 @@ SUBSCRIPTION_PLANS = {
         "price": 5000,
         "currency": "NGN",
         "leads_limit": 100,
+        "ai_messages_limit": AI_QUOTAS["pro"],
         "description": "For growing businesses"
     },
     "enterprise": {
@@ -40,6 +44,7 @@ SUBSCRIPTION_PLANS = {
         "price": 15000,
         "currency": "NGN",
         "leads_limit": 1000,
+        "ai_messages_limit": AI_QUOTAS["enterprise"],
         "description": "For large-scale operations"
     }
 }
@@ -136,6 +141,7 @@ async def handle_stripe_webhook(request: Request, session: AsyncSession = Depend
                 user.subscription_expires_at = datetime.utcnow() + timedelta(days=30)
                 session.add(user)
                 await session.commit()
+                invalidate_principal(user.email)
     return {"status": "success"}
 
 @router.post("/cancel")
@@ -144,21 +150,17 @@ async def cancel_subscription(session: AsyncSession = Depends(get_session), user
     user.subscription_status = "cancelled"
     session.add(user)
     await session.commit()
+    invalidate_principal(user.email)
     
     return {"message": "Subscription cancelled successfully"}
 
 @router.get("/usage")
 async def get_usage_stats(session: AsyncSession = Depends(get_session), user: User = Depends(get_current_user)):
     """Get user's current usage statistics"""
-    from models import Lead, Campaign, Notification
-    # Count total leads across all user's campaigns
-    result = await session.execute(
-        select(Lead)
-        .join(Campaign)
-        .where(Campaign.user_id == user.id)
-    )
-    leads = result.scalars().all()
-    current_usage = len(leads)
+    from models import Notification
+    from usage import get_usage
+    usage = await get_usage(session, user.id)
+    current_usage = usage["leads_owned"]
     plan = SUBSCRIPTION_PLANS.get(user.subscription_tier, SUBSCRIPTION_PLANS["free"])
     limit = plan["leads_limit"]
     warning_threshold = limit * 0.8
@@ -181,6 +183,7 @@ async def get_usage_stats(session: AsyncSession = Depends(get_session), user: Us
             )
             session.add(notification)
             await session.commit()
+            pubsub.publish(user_topic(user.id, "notifications"))
     return {
         "current_usage": current_usage,
         "limit": limit,
@@ -0,0 +1,161 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from database import async_session
+from models import Campaign, FollowUpEmail, FollowUpMessage, Lead, Notification, OutreachLog
+from jobs import enqueue, job_handler
+from usage import MESSAGED_STATUSES
+from events import pubsub, user_topic
+
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "100"))
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "30"))
+
+# model -> job kind that delivers it
+DISPATCH_KINDS = (
+    (FollowUpEmail, "follow_up_email"),
+    (FollowUpMessage, "follow_up_message"),
+)
+
+
+async def schedule_next_follow_up(session: AsyncSession, model, parent_column, parent_id: int, after: datetime) -> Optional[datetime]:
+    """
+    Schedule the parent's next pending follow-up `delay_days` after the
+    previous step went out. Follow-ups run in creation order, one at a time,
+    so only the step that is actually due next sits in the scheduler index.
+    Does not commit.
+    """
+    result = await session.execute(
+        select(model)
+        .where(parent_column == parent_id, model.status == "pending")
+        .order_by(model.id)
+        .limit(1)
+    )
+    follow_up = result.scalar_one_or_none()
+    if follow_up is None:
+        return None
+    follow_up.scheduled_at = after + timedelta(days=follow_up.delay_days)
+    follow_up.status = "scheduled"
+    session.add(follow_up)
+    return follow_up.scheduled_at
+
+
+async def start_follow_up_sequence(session: AsyncSession, model, parent_column, parent_id: int, after: datetime) -> Optional[datetime]:
+    """
+    Schedule the parent's first follow-up, unless the sequence has already
+    started. Repeated base sends must not advance the sequence; only a
+    follow-up's own delivery schedules the step after it.
+    """
+    result = await session.execute(
+        select(model.id).where(parent_column == parent_id, model.status != "pending").limit(1)
+    )
+    if result.first() is not None:
+        return None
+    return await schedule_next_follow_up(session, model, parent_column, parent_id, after)
+
+
+async def start_follow_up_messages(session: AsyncSession, campaign_id: int, after: datetime) -> Optional[datetime]:
+    """Schedule a LinkedIn campaign's first follow-up, unless the sequence has already started."""
+    return await start_follow_up_sequence(session, FollowUpMessage, FollowUpMessage.campaign_id, campaign_id, after)
+
+
+async def claim_due(session: AsyncSession, model, limit: int) -> List[int]:
+    """
+    Move up to `limit` due follow-ups from scheduled to dispatching. The
+    candidate scan is a range read on (status, scheduled_at), so its cost
+    depends on the batch size, not on how many follow-ups are pending.
+    PostgreSQL's FOR UPDATE SKIP LOCKED keeps concurrent schedulers on
+    disjoint rows; the row locks are held until the caller commits.
+    """
+    candidates = (
+        select(model.id)
+        .where(model.status == "scheduled", model.scheduled_at <= datetime.utcnow())
+        .order_by(model.scheduled_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(model)
+        .where(model.id.in_(candidates))
+        .values(status="dispatching")
+        .returning(model.id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars().all())
+
+
+async def dispatch_due() -> int:
+    """
+    One scheduler tick: hand every due follow-up to the job queue. Each batch
+    is claimed and enqueued in a single transaction, so a scheduler that dies
+    mid-batch rolls back and leaves the rows scheduled, and a committed claim
+    always has exactly one delivery job behind it.
+    """
+    dispatched = 0
+    for model, kind in DISPATCH_KINDS:
+        while True:
+            async with async_session() as session:
+                ids = await claim_due(session, model, SCHEDULER_BATCH_SIZE)
+                for follow_up_id in ids:
+                    await enqueue(session, kind, {"follow_up_id": follow_up_id})
+                await session.commit()
+            dispatched += len(ids)
+            if len(ids) < SCHEDULER_BATCH_SIZE:
+                break
+    if dispatched:
+        logging.info(f"Scheduler dispatched {dispatched} follow-ups")
+    return dispatched
+
+
+async def mark_follow_up_failed(model, follow_up_id: int):
+    async with async_session() as session:
+        await session.execute(update(model).where(model.id == follow_up_id).values(status="failed"))
+        await session.commit()
+
+
+async def _follow_up_message_dead(payload: dict, error: str):
+    await mark_follow_up_failed(FollowUpMessage, payload["follow_up_id"])
+
+
+@job_handler("follow_up_message", on_dead=_follow_up_message_dead)
+async def handle_follow_up_message(payload: dict):
+    """
+    LinkedIn messages are sent by the user, so delivering a follow-up means
+    queueing an outreach entry for each lead already messaged in the
+    campaign (replies excluded) and notifying the campaign owner.
+    """
+    async with async_session() as session:
+        follow_up = await session.get(FollowUpMessage, payload["follow_up_id"])
+        if follow_up is None or follow_up.status != "dispatching":
+            return
+        campaign = await session.get(Campaign, follow_up.campaign_id)
+        result = await session.execute(
+            select(Lead.id).where(
+                Lead.campaign_id == campaign.id,
+                Lead.status.in_([s for s in MESSAGED_STATUSES if s != "replied"]),
+            )
+        )
+        lead_ids = result.scalars().all()
+        now = datetime.utcnow()
+        if lead_ids:
+            await session.execute(insert(OutreachLog), [
+                {"lead_id": lead_id, "user_id": campaign.user_id, "status": "follow_up_due", "message": follow_up.body, "timestamp": now}
+                for lead_id in lead_ids
+            ])
+            session.add(Notification(
+                user_id=campaign.user_id,
+                type="follow_up_due",
+                message=f"{len(lead_ids)} follow-up messages are due in campaign '{campaign.name}'.",
+                created_at=now
+            ))
+        follow_up.status = "sent"
+        session.add(follow_up)
+        await schedule_next_follow_up(session, FollowUpMessage, FollowUpMessage.campaign_id, campaign.id, now)
+        await session.commit()
+        pubsub.publish(user_topic(campaign.user_id, "activity"))
+        if lead_ids:
+            pubsub.publish(user_topic(campaign.user_id, "notifications"))
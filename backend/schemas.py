@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Any, Optional, List
 from datetime import datetime
 # Web scraping request/response schemas for SerpApi
 class WebScrapeLeadsRequest(BaseModel):
@@ -54,21 +54,23 @@ class Token(BaseModel):
 class LeadUpload(BaseModel):
     file: bytes  # Will use UploadFile in endpoint
 
+# Every field but id is optional so /leads/list can return column projections
 class LeadOut(BaseModel):
     id: int
-    first_name: str
-    last_name: str
-    job_title: str
-    company: str
-    profile_url: str
-    status: str
-    message_text: Optional[str]
-    email: Optional[str]
-    email_confidence: Optional[int]
-    campaign_id: int
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    job_title: Optional[str] = None
+    company: Optional[str] = None
+    profile_url: Optional[str] = None
+    status: Optional[str] = None
+    message_text: Optional[str] = None
+    email: Optional[str] = None
+    email_confidence: Optional[int] = None
+    campaign_id: Optional[int] = None
 
 class LeadListResponse(BaseModel):
     leads: List[LeadOut]
+    next_cursor: Optional[int] = None
 
 class CampaignStats(BaseModel):
     sent: int
@@ -81,11 +83,20 @@ class OutreachLogCreate(BaseModel):
     status: str
     message: str
 
+class OutreachLogBatchItem(OutreachLogCreate):
+    # When the action happened; defaults to when the batch is received
+    timestamp: Optional[datetime] = None
+
+class OutreachLogBatch(BaseModel):
+    # Validated one by one so a bad entry is rejected on its own
+    entries: List[Any]
+
 class MessageGenRequest(BaseModel):
     lead_id: int
 
 class MessageGenResponse(BaseModel):
     message: str
+    cached: bool = False
 
 
 class FollowUpEmailCreate(BaseModel):
@@ -124,4 +135,25 @@ class EmailLogOut(BaseModel):
     status: str
     sent_at: Optional[datetime]
     opened_at: Optional[datetime]
-    error: Optional[str]
\ No newline at end of file
+    error: Optional[str]
+
+class NotificationCreate(BaseModel):
+    type: str
+    message: str
+
+class NotificationOut(BaseModel):
+    id: int
+    type: str
+    message: str
+    read: bool
+    created_at: datetime
+
+class NotificationListResponse(BaseModel):
+    notifications: List[NotificationOut]
+    next_cursor: Optional[int] = None
+    unread_count: int
+
+class NotificationMarkRead(BaseModel):
+    # Specific notifications, or every one up to and including this id; all when neither is given
+    ids: Optional[List[int]] = None
+    up_to: Optional[int] = None
@@ -0,0 +1,141 @@
+"""
+Personalization templates for campaign emails.
+
+Placeholders use str.format syntax, `{first_name}`, with an optional inline
+fallback after a bar, `{first_name|there}`, used when the lead has no value.
+`{{` and `}}` are literal braces. Templates are parsed once and cached, so a
+send renders each lead with a list join instead of re-parsing.
+"""
+import string
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Lead columns every template can use; anything else must come from
+# per-lead personalization or send-level defaults
+LEAD_VARIABLES = ("first_name", "last_name", "company", "job_title")
+COMPILED_CACHE_SIZE = 512
+
+_formatter = string.Formatter()
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    """A parsed template: literal text interleaved with (variable, fallback) slots."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts: List[Tuple[str, Optional[str], Optional[str]]] = []
+        try:
+            parsed = list(_formatter.parse(source))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}")
+        for literal, field, spec, conversion in parsed:
+            if field is None:
+                self.parts.append((literal, None, None))
+                continue
+            if conversion or spec:
+                raise TemplateError(f"Placeholder {{{field}}} can't use '!' or ':' formatting")
+            name, bar, fallback = field.partition("|")
+            name = name.strip()
+            if not name.isidentifier():
+                raise TemplateError(f"Invalid placeholder {{{field}}}; use a variable name like {{first_name}}")
+            self.parts.append((literal, name, fallback if bar else None))
+        self.variables = tuple(dict.fromkeys(name for _, name, _ in self.parts if name))
+        # Variables without an inline fallback; a lead missing one can't be rendered
+        self.required = tuple(dict.fromkeys(name for _, name, fallback in self.parts if name and fallback is None))
+
+    def render(self, values: Dict[str, object]) -> Tuple[str, List[str]]:
+        """Returns (text, missing variable names). The text is incomplete if anything is missing."""
+        out, missing = [], []
+        for literal, name, fallback in self.parts:
+            out.append(literal)
+            if name is None:
+                continue
+            value = values.get(name)
+            if value is None or value == "":
+                if fallback is None:
+                    missing.append(name)
+                    continue
+                value = fallback
+            out.append(str(value))
+        return "".join(out), missing
+
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def compile_template(source: str) -> CompiledTemplate:
+    return CompiledTemplate(source or "")
+
+
+def validate(**templates: str) -> dict:
+    """
+    Compile each named template, raising TemplateError naming the first bad
+    one. Returns the variables used that aren't lead fields, which sends
+    must supply through personalization or defaults.
+    """
+    custom = []
+    for label, source in templates.items():
+        try:
+            compiled = compile_template(source)
+        except TemplateError as e:
+            raise TemplateError(f"{label}: {e}")
+        custom.extend(name for name in compiled.required if name not in LEAD_VARIABLES)
+    return {"custom_variables": list(dict.fromkeys(custom))}
+
+
+def validate_follow_ups(**templates: str):
+    """
+    validate() for follow-up steps. Follow-ups go to every lead the campaign
+    reached, without any send's personalization or defaults, so a variable
+    that isn't a lead field needs an inline fallback.
+    """
+    for label, source in templates.items():
+        custom = validate(**{label: source})["custom_variables"]
+        if custom:
+            raise TemplateError(
+                f"{label}: follow-ups can only use lead fields ({', '.join(LEAD_VARIABLES)}); "
+                f"give {{{custom[0]}}} a fallback, e.g. {{{custom[0]}|there}}"
+            )
+
+
+def lead_values(lead: dict, overrides: Optional[dict] = None, defaults: Optional[dict] = None) -> dict:
+    """Send-level defaults, then the lead's non-empty fields, then its personalization overrides."""
+    values = dict(defaults or {})
+    for source in (lead, overrides or {}):
+        values.update({key: value for key, value in source.items() if value is not None and value != ""})
+    return values
+
+
+class MessageTemplate:
+    """A subject/body pair compiled once and rendered per lead."""
+
+    def __init__(self, subject: str, body: str, defaults: Optional[dict] = None):
+        self.subject = compile_template(subject)
+        self.body = compile_template(body)
+        self.defaults = defaults or {}
+
+    def render(self, lead: dict, overrides: Optional[dict] = None) -> Tuple[str, str, List[str]]:
+        values = lead_values(lead, overrides, self.defaults)
+        subject, missing = self.subject.render(values)
+        body, body_missing = self.body.render(values)
+        return subject, body, list(dict.fromkeys(missing + body_missing))
+
+    def render_batch(self, leads: Iterable[dict], personalization: Optional[Dict[str, dict]] = None):
+        """Yield (lead, subject, body, missing) for each lead; leads carry their id under "id"."""
+        personalization = personalization or {}
+        for lead in leads:
+            subject, body, missing = self.render(lead, personalization.get(str(lead.get("id")), {}))
+            yield lead, subject, body, missing
+
+    def report(self, leads: Iterable[dict], personalization: Optional[Dict[str, dict]] = None) -> dict:
+        """How many leads would render incompletely, and which variables they lack."""
+        checked, incomplete, by_variable = 0, 0, Counter()
+        for _, _, _, missing in self.render_batch(leads, personalization):
+            checked += 1
+            if missing:
+                incomplete += 1
+                by_variable.update(missing)
+        return {"leads_checked": checked, "leads_missing_variables": incomplete, "missing_by_variable": dict(by_variable)}
@@ -0,0 +1,118 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from models import UsageCounter, Lead, Campaign, EmailLog, EmailCampaign
+from database import dialect_insert
+
+LIFETIME = "all"
+# Lead statuses that count as a message having been sent to the lead
+MESSAGED_STATUSES = ("contacted", "sent", "replied", "connected")
+
+
+def current_period(now: Optional[datetime] = None) -> str:
+    return (now or datetime.utcnow()).strftime("%Y-%m")
+
+
+def is_messaged(status: Optional[str]) -> bool:
+    return status in MESSAGED_STATUSES
+
+
+async def _count_usage(session: AsyncSession, user_id: int) -> dict:
+    leads_result = await session.execute(
+        select(
+            func.count(Lead.id),
+            func.count(Lead.id).filter(Lead.status.in_(MESSAGED_STATUSES)),
+        )
+        .join(Campaign)
+        .where(Campaign.user_id == user_id)
+    )
+    leads_owned, messages_sent = leads_result.one()
+    emails_result = await session.execute(
+        select(func.count(EmailLog.id))
+        .join(EmailCampaign)
+        .where(EmailCampaign.user_id == user_id, EmailLog.status == "sent")
+    )
+    return {"leads_owned": leads_owned, "messages_sent": messages_sent, "emails_sent": emails_result.scalar_one()}
+
+
+async def _backfill(session: AsyncSession, user_id: int) -> bool:
+    """Seed the lifetime row from a one-off count. Returns False if another transaction won the race."""
+    counts = await _count_usage(session, user_id)
+    stmt = (
+        dialect_insert(UsageCounter)
+        .values(user_id=user_id, period=LIFETIME, updated_at=datetime.utcnow(), **counts)
+        .on_conflict_do_nothing()
+        .returning(UsageCounter.id)
+    )
+    result = await session.execute(stmt)
+    return result.first() is not None
+
+
+async def _increment(session: AsyncSession, user_id: int, period: str, leads: int, messages: int, emails: int):
+    stmt = dialect_insert(UsageCounter).values(
+        user_id=user_id,
+        period=period,
+        leads_owned=leads,
+        messages_sent=messages,
+        emails_sent=emails,
+        updated_at=datetime.utcnow(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "period"],
+        set_={
+            "leads_owned": UsageCounter.leads_owned + stmt.excluded.leads_owned,
+            "messages_sent": UsageCounter.messages_sent + stmt.excluded.messages_sent,
+            "emails_sent": UsageCounter.emails_sent + stmt.excluded.emails_sent,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await session.execute(stmt)
+
+
+async def _lifetime_row(session: AsyncSession, user_id: int):
+    # Plain columns rather than the entity: counters change through Core
+    # upserts, which would leave an identity-mapped UsageCounter stale.
+    result = await session.execute(
+        select(UsageCounter.leads_owned, UsageCounter.messages_sent)
+        .where(UsageCounter.user_id == user_id, UsageCounter.period == LIFETIME)
+    )
+    return result.first()
+
+
+async def record_usage(session: AsyncSession, user_id: int, leads: int = 0, messages: int = 0, emails: int = 0):
+    """
+    Apply usage deltas inside the caller's transaction. Call it after the
+    writes being counted, before the commit.
+    """
+    if not (leads or messages or emails):
+        return
+    lifetime = await _lifetime_row(session, user_id)
+    # A first-time backfill already counts this transaction's own writes
+    if lifetime is not None or not await _backfill(session, user_id):
+        await _increment(session, user_id, LIFETIME, leads, messages, emails)
+    await _increment(session, user_id, current_period(), leads, messages, emails)
+
+
+async def get_usage(session: AsyncSession, user_id: int) -> dict:
+    """
+    Current usage for a user: lifetime leads/messages plus emails sent this
+    month. Backfills and commits the lifetime row the first time it is read.
+    """
+    lifetime = await _lifetime_row(session, user_id)
+    if lifetime is None:
+        await _backfill(session, user_id)
+        await session.commit()
+        lifetime = await _lifetime_row(session, user_id)
+    period = current_period()
+    monthly_result = await session.execute(
+        select(UsageCounter.emails_sent).where(UsageCounter.user_id == user_id, UsageCounter.period == period)
+    )
+    return {
+        "leads_owned": lifetime.leads_owned,
+        "messages_sent": lifetime.messages_sent,
+        "emails_sent": monthly_result.scalar_one_or_none() or 0,
+        "period": period,
+    }
@@ -0,0 +1,136 @@
+"""
+Standalone job worker.
+
+    python worker.py --concurrency 8
+
+Claims jobs from the job table, runs up to `concurrency` of them at once and
+retries failures with backoff until they are dead-lettered. Every worker also
+runs the follow-up scheduler. Any number of workers can run against the same
+database.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, List, Tuple
+
+from jobs import HANDLERS, JOB_VISIBILITY_TIMEOUT, claim_jobs, complete_job, fail_job, heartbeat, requeue_expired
+# Imported for their @job_handler registrations
+import ai_messages  # noqa: F401
+import email_sender  # noqa: F401
+from ai_messages import message_cache
+from ai_ledger import AI_LEDGER_FLUSH_INTERVAL, ledger
+from http_client import close_client
+from enrichment import enrichment_cache
+from lead_search import search_cache
+from scheduler import SCHEDULER_INTERVAL, dispatch_due
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+
+# (interval in seconds, coroutine function) run by every worker between polls
+PERIODIC_TASKS: List[Tuple[float, Callable[[], Awaitable]]] = [
+    (3600, enrichment_cache.purge_expired),
+    (3600, message_cache.purge_expired),
+    (3600, search_cache.purge_expired),
+    (SCHEDULER_INTERVAL, dispatch_due),
+    (AI_LEDGER_FLUSH_INTERVAL, ledger.flush),
+]
+
+
+class Worker:
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, poll_interval: float = WORKER_POLL_INTERVAL):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.active: set = set()
+        self.stopping = asyncio.Event()
+        self._last_run = {}
+
+    def stop(self):
+        self.stopping.set()
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(JOB_VISIBILITY_TIMEOUT / 3)
+            try:
+                await heartbeat(job_id, self.id)
+            except Exception:
+                logging.exception(f"Heartbeat failed for job {job_id}")
+
+    async def run_job(self, job: dict):
+        beat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            handler = HANDLERS.get(job["kind"])
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+            await handler(json.loads(job["payload"]))
+        except Exception as e:
+            logging.exception(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}")
+            await fail_job(job, self.id, f"{type(e).__name__}: {e}")
+        else:
+            await complete_job(job["id"], self.id)
+        finally:
+            beat.cancel()
+
+    async def _run_periodic(self):
+        now = time.monotonic()
+        for interval, task in PERIODIC_TASKS:
+            if now - self._last_run.get(task, float("-inf")) >= interval:
+                self._last_run[task] = now
+                try:
+                    await task()
+                except Exception:
+                    logging.exception(f"Periodic task {task.__qualname__} failed")
+
+    async def _wait(self):
+        # Wake up early if a job finishes or we're asked to stop
+        waiters = [asyncio.create_task(self.stopping.wait()), *self.active]
+        await asyncio.wait(waiters, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+        waiters[0].cancel()
+
+    async def run(self):
+        logging.info(f"Worker {self.id} started with concurrency {self.concurrency}")
+        while not self.stopping.is_set():
+            claimed = []
+            try:
+                await self._run_periodic()
+                await requeue_expired()
+                free = self.concurrency - len(self.active)
+                if free > 0:
+                    claimed = await claim_jobs(self.id, free)
+            except Exception:
+                logging.exception("Worker poll failed")
+            for job in claimed:
+                task = asyncio.create_task(self.run_job(job))
+                self.active.add(task)
+                task.add_done_callback(self.active.discard)
+            # Keep draining while the queue has work and slots are free
+            if not claimed or len(self.active) >= self.concurrency:
+                await self._wait()
+        logging.info(f"Worker {self.id} stopping, waiting for {len(self.active)} running jobs")
+        await asyncio.gather(*self.active, return_exceptions=True)
+        await ledger.flush()
+
+
+async def main(concurrency: int, poll_interval: float):
+    worker = Worker(concurrency, poll_interval)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+    await close_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LeadPilot background job worker")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(main(args.concurrency, args.poll_interval))
@@ -197,8 +197,15 @@ export default function EmailCampaigns() {
   useEffect(() => {
     if (sendDialogOpen) {
       (async () => {
-        const res = await apiRequest("GET", `${apiUrl}/api/leads/list`);
-        const data = await res.json();
+        // The list is keyset-paginated; follow next_cursor until every page is loaded
+        const data: { leads: any[] } = { leads: [] };
+        let cursor: number | null = null;
+        do {
+          const res = await apiRequest("GET", `${apiUrl}/api/leads/list?page_size=500${cursor !== null ? `&cursor=${cursor}` : ""}`);
+          const page = await res.json();
+          data.leads.push(...page.leads);
+          cursor = page.next_cursor ?? null;
+        } while (cursor !== null);
         setSendLeads(data.leads || []);
         setPersonalization(
           Object.fromEntries((data.leads || []).map((l: any) => [l.id, { first_name: l.first_name, company: l.company }]))
@@ -213,7 +220,7 @@ export default function EmailCampaigns() {
       setLogsLoading(true);
       apiRequest("GET", `${apiUrl}/api/email-campaigns/${logsCampaign.id}/logs`)
         .then(res => res.json())
-        .then(data => setLogs(data))
+        .then(data => setLogs(data.logs))
         .finally(() => setLogsLoading(false));
     }
   }, [logsDialogOpen, logsCampaign]);
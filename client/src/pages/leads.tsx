@@ -33,7 +33,7 @@ export default function Leads() {
   const queryClient = useQueryClient();
   const enrichEmailMutation = useMutation({
     mutationFn: async (leadId: number) => {
-      const res = await apiRequest("POST", `${apiUrl}/api/enrich-email`, { leadId });
+      const res = await apiRequest("POST", `${apiUrl}/api/leads/enrich-email`, { leadId });
       return await res.json();
     },
     onSuccess: (data) => {
@@ -72,8 +72,16 @@ export default function Leads() {
   const { data: leads, isLoading, refetch } = useQuery<{leads: Lead[]}>({
     queryKey: ["http://localhost:8000/api/leads/list", showUnassigned],
     queryFn: async () => {
-      const res = await apiRequest("GET", `${apiUrl}/api/leads/list?unassigned=${showUnassigned}`);
-      return await res.json();
+      // The list is keyset-paginated; follow next_cursor until every page is loaded
+      const all: Lead[] = [];
+      let cursor: number | null = null;
+      do {
+        const res = await apiRequest("GET", `${apiUrl}/api/leads/list?unassigned=${showUnassigned}&page_size=500${cursor !== null ? `&cursor=${cursor}` : ""}`);
+        const page = await res.json();
+        all.push(...page.leads);
+        cursor = page.next_cursor ?? null;
+      } while (cursor !== null);
+      return { leads: all };
     },
   });
 
@@ -83,7 +91,7 @@ export default function Leads() {
 
   const updateLeadMutation = useMutation({
     mutationFn: async ({ leadId, status }: { leadId: number; status: string }) => {
-      const res = await apiRequest("PUT", `${apiUrl}/api/${leadId}`, { status });
+      const res = await apiRequest("PUT", `${apiUrl}/api/leads/${leadId}`, { status });
       return await res.json();
     },
     onSuccess: (data) => {
@@ -129,7 +137,7 @@ export default function Leads() {
 
   const deleteLeadMutation = useMutation({
     mutationFn: async (leadId: number) => {
-      const res = await apiRequest("DELETE", `${apiUrl}/api/${leadId}`);
+      const res = await apiRequest("DELETE", `${apiUrl}/api/leads/${leadId}`);
       return await res.json();
     },
     onSuccess: () => {
@@ -151,7 +159,7 @@ export default function Leads() {
   // Add mutation for scraping LinkedIn leads
   const scrapeLeadsMutation = useMutation({
     mutationFn: async (filters: typeof scrapeForm) => {
-      const res = await apiRequest("POST", `${apiUrl}/api/scrape-linkedin-leads`, filters);
+      const res = await apiRequest("POST", `${apiUrl}/api/leads/scrape-linkedin-leads`, filters);
       return await res.json();
     },
     onSuccess: (data) => {
@@ -173,7 +181,7 @@ export default function Leads() {
   // Export leads as CSV (with auth)
   const handleExport = async () => {
     const token = localStorage.getItem("access_token");
-    const url = `${apiUrl}/api/export?unassigned=${showUnassigned}`;
+    const url = `${apiUrl}/api/leads/export?unassigned=${showUnassigned}`;
     if (!token) {
       toast({ title: "Not authenticated", description: "Please log in to export leads.", variant: "destructive" });
       return;
@@ -232,7 +240,7 @@ export default function Leads() {
     setUploading(true);
     try {
       const text = await pendingFile.text();
-      const res = await apiRequest("POST", `${apiUrl}/api/upload`, {
+      const res = await apiRequest("POST", `${apiUrl}/api/leads/upload`, {
         csvData: text,
         campaignId: uploadCampaign,
       });
@@ -252,7 +260,7 @@ export default function Leads() {
   const handleAssignToCampaign = async () => {
     setAssigning(true);
     try {
-      const res = await apiRequest("POST", `${apiUrl}/api/assign-to-campaign`, {
+      const res = await apiRequest("POST", `${apiUrl}/api/leads/assign-to-campaign`, {
         leadIds: selectedLeads,
         campaignId: selectedCampaign,
       });